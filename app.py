@@ -1,10 +1,54 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 from datetime import datetime
-import time
+import hashlib
+import io
+import os
 import random
 import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from instrumentation import StageRecorder
+from kundali_report import report_bundle
+from live_tail import LiveTail
+from result_cache import ResultCache
+from trade_store import TradeStore
+from pnl_analysis import (
+    DEFAULT_FEE_SCHEDULE,
+    behaviour_summary,
+    build_trade_cube,
+    decimate,
+    enrich_trades,
+    equity_curve,
+    exit_times,
+    fill_charges,
+    flag_overtrading_days,
+    flag_revenge_trades,
+    flag_size_escalation,
+    holding_box_stats,
+    mark_to_market,
+    match_fifo,
+    memory_report,
+    merge_tradebooks,
+    missing_columns,
+    net_pnl,
+    open_inventory,
+    performance_stats,
+    pnl_table,
+    position_table,
+    read_prices,
+    read_tradebook,
+    rollup_pnl,
+    round_trips,
+    side_summary,
+    sorted_page,
+    summarize_account,
+    tag_index_name,
+    time_slice
+)
 
 # 🎨 Fun theme setup
 st.set_page_config(
@@ -34,6 +78,46 @@ else:
 st.title("💰📈 Trading PnL Funhouse 🎢📉")
 st.caption("Comment on my article for any changes - https://medium.com/@abhi771991/decoding-your-trading-destiny-introducing-your-trading-kundali-6152b6e96ecc")
 
+# 📚 Optional trade history, only when PNL_HISTORY_DIR is set: uploads under the same name are merged,
+# adding only new fills. Every session sees the same names, so enable it on private deployments only
+HISTORY_DIR = os.environ.get('PNL_HISTORY_DIR')
+history_name = ''
+if HISTORY_DIR:
+    history_name = st.sidebar.text_input("📚 Keep my trade history as",
+                                         help="Weekly exports under the same name are merged; only new fills are processed. "
+                                              "Several files at once are kept apart by account.")
+history_account = re.sub(r'[^a-z0-9_-]+', '_', history_name.strip().lower()).strip('_')
+
+# 💸 Brokerage & taxes, deducted from every PnL figure unless switched off
+fee_schedule = None
+if st.sidebar.checkbox("💸 Deduct brokerage & taxes", value=True,
+                       help="Brokerage, STT, exchange & SEBI fees, stamp duty and GST per fill."):
+    with st.sidebar.expander("Fee schedule (per exchange, segment & instrument)"):
+        st.caption("*_pct columns are % of turnover. Brokerage is per order, capped at brokerage_pct when set.")
+        fee_schedule = st.data_editor(DEFAULT_FEE_SCHEDULE, num_rows='dynamic', hide_index=True, key='fee_schedule')
+
+# 🔴 Live tail of a growing tradebook, only for files under PNL_LIVE_ROOT on this server
+LIVE_ROOT = os.environ.get('PNL_LIVE_ROOT')
+LIVE_REFRESH_SECONDS = 5
+live_source = None
+if LIVE_ROOT:
+    live_name = st.sidebar.text_input("🔴 Live tail (CSV or drop folder)",
+                                      help=f"Path inside {LIVE_ROOT}, refreshed every {LIVE_REFRESH_SECONDS}s.")
+    if live_name.strip():
+        live_root = Path(LIVE_ROOT).resolve()
+        candidate = (live_root / live_name.strip()).resolve()
+        if candidate.is_relative_to(live_root) and candidate.exists():
+            live_source = candidate
+        else:
+            st.sidebar.error(f"🚨 No such file or folder in {LIVE_ROOT}")
+
+# 🐞 Opt-in stage timings (sidebar checkbox or ?debug=1 in the URL). Peak memory needs tracemalloc, which
+# slows every session on the server, so only PNL_TRACE_MEMORY=1 on the server turns it on
+TRACE_MEMORY = os.environ.get('PNL_TRACE_MEMORY') == '1'
+debug_mode = st.sidebar.checkbox("🐞 Show stage timings", value=st.query_params.get('debug') == '1')
+recorder = StageRecorder(trace_memory=debug_mode and TRACE_MEMORY)
+loaded_frames = {}  # frames held for this upload, for the memory report
+
 # 👥 Visitor stats
 col1, col2, col3 = st.columns(3)
 with col1:
@@ -54,169 +138,528 @@ def check_badges(symbol_count, pnl_value):
         new_badges.append("💰 Big Winner")
     return new_badges
 
-# ⏱️ Function to calculate holding times (defined once at the top)
-def calculate_holding_times(trade_df):
+# 🧹 Parse, enrich & analyze (cached per upload so widget reruns skip it)
+RESULT_CACHE_DIR = os.environ.get('PNL_CACHE_DIR', '.pnl_cache')
+RESULT_CACHE_MAX_MB = int(os.environ.get('PNL_CACHE_MAX_MB', '2048'))
+UPLOAD_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def upload_digest(uploaded_file):
+    """
+    Content hash of an upload, computed once per uploaded file in this session
+    """
+    digests = st.session_state.setdefault('upload_digests', {})
+    if uploaded_file.file_id not in digests:
+        digests[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    return digests[uploaded_file.file_id]
+
+
+@st.cache_resource(show_spinner=False)
+def result_cache():
+    """
+    The on-disk result cache shared by every session of this server
+    """
+    return ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_MB * 2**20)
+
+
+def cached_frame(file_digest, name, compute):
     """
-    Calculate holding times for completed trades (buy-sell pairs)
+    A frame from the on-disk result cache, computed and stored on a miss
     """
-    # Make a copy to avoid warnings
-    trades_df = trade_df.copy()
+    frame = result_cache().load(file_digest, name)
+    if frame is None:
+        frame = compute()
+        result_cache().store(file_digest, name, frame)
+    return frame
+
+
+def combined_digest(uploads):
+    """
+    One key for a set of uploads and the accounts they were assigned
+    """
+    parts = sorted(f'{file_digest}:{account}' for file_digest, _, _, account in uploads)
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+
+def parse_upload(cache, file_digest, file_bytes, file_name):
+    """
+    Parse and enrich one uploaded file, or take it from the result cache.
+
+    Runs on a worker thread, so the cache is passed in rather than fetched
+    through Streamlit.
+    """
+    # 💾 Same file seen before (by anyone, before a restart)?
+    df = cache.load(file_digest, 'trades')
+    if df is not None:
+        return df, []
     
-    # Sort by symbol and time
-    trades_df = trades_df.sort_values(['symbol', 'order_execution_time'])
+    # 📊 Read data
+    df = read_tradebook(io.BytesIO(file_bytes), file_name)
     
-    holding_times = []
+    # Check required columns
+    missing_cols = missing_columns(df)
+    if not missing_cols:
+        df = enrich_trades(df)
+        cache.store(file_digest, 'trades', df)
+    return df, missing_cols
+
+
+@st.cache_resource(max_entries=8, show_spinner="🧹 Reading your trades...")
+def load_trades(upload_key, _uploads):
+    """
+    Parse every uploaded file and merge them into one frame tagged with account.
+
+    _uploads holds (file_digest, file_bytes, file_name, account) per file and
+    upload_key is their combined_digest. Files are parsed on a thread pool
+    (the pyarrow CSV reader and the vectorized enrichment release the GIL, and
+    no frame has to be pickled between processes), so a batch takes about as
+    long as its largest file. Returns the merged trades, or None when no file
+    is valid, and the missing columns of every invalid file.
+
+    The returned frame is shared across reruns and sessions, so callers must
+    treat it as read-only. Least recently used uploads are evicted past
+    max_entries.
+    """
+    cache = result_cache()
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        parsed = list(pool.map(lambda upload: parse_upload(cache, *upload[:3]), _uploads))
+    problems = {upload[2]: missing_cols for upload, (_, missing_cols) in zip(_uploads, parsed) if missing_cols}
+    valid = [(df, upload[3]) for upload, (df, missing_cols) in zip(_uploads, parsed) if not missing_cols]
+    if not valid:
+        return None, problems
+    frames, accounts = zip(*valid)
+    return merge_tradebooks(frames, accounts), problems
+
+
+def charged_digest(file_digest, schedule):
+    """
+    Key for an upload analyzed net of a fee schedule, so each schedule gets its own cached results
+    """
+    return hashlib.sha256(f"{file_digest}|{schedule.to_csv(index=False)}".encode()).hexdigest()
+
+
+@st.cache_resource(max_entries=8, show_spinner="💸 Working out your charges...")
+def with_charges(file_digest, _df, _schedule):
+    """
+    The trades with the charges of every fill, and how many fills no schedule row covers
+    """
+    charges = fill_charges(_df, _schedule)
+    return _df.assign(charges=charges.fillna(0)), int(charges.isna().sum())
+
+
+@st.cache_resource(max_entries=8, show_spinner="⏱️ Matching your buys and sells...")
+def match_trades(file_digest, _df):
+    """
+    FIFO-match the whole upload once; returns the matched trades tagged with their index and the open lots.
+
+    Matching never crosses symbols (or accounts), so slicing this table by
+    index_name or account gives the same result as matching that slice on its
+    own.
+    """
+    matched = result_cache().load(file_digest, 'matched')
+    open_lots = result_cache().load(file_digest, 'open_lots')
+    if matched is None or open_lots is None:
+        matched, open_lots = match_fifo(_df)
+        matched = tag_index_name(matched, _df)
+        result_cache().store(file_digest, 'matched', matched)
+        result_cache().store(file_digest, 'open_lots', open_lots)
+    return matched, open_lots
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def box_stats(file_digest, _all_holding_df):
+    """
+    Holding-time box statistics per index and outcome, computed once per upload
+    """
+    return holding_box_stats(_all_holding_df, keys=['index_name'])
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def performance(file_digest, _all_holding_df):
+    """
+    Equity curves (thinned for plotting) and drawdown/streak stats, per index, per account and overall
+    """
+    curves = equity_curve(_all_holding_df, ['index_name'])
+    return {
+        'stats': performance_stats(_all_holding_df, ['index_name']),
+        'account_stats': (performance_stats(_all_holding_df, ['account'])
+                          if 'account' in _all_holding_df.columns else None),
+        'overall': performance_stats(_all_holding_df),
+        'curves': {name: decimate(curve, ['equity', 'drawdown'])
+                   for name, curve in curves.groupby('index_name', observed=True)},
+        'overall_curve': decimate(equity_curve(_all_holding_df), ['equity', 'drawdown'])
+    }
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def trips_of(file_digest, _all_holding_df):
+    """
+    Matched pieces collapsed into round trips, once per upload
+    """
+    return round_trips(_all_holding_df)
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def positions_of(file_digest, _open_lots, _df):
+    """
+    Open lots with their side, index and expiry, once per upload
+    """
+    return open_inventory(_open_lots, _df)
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def full_report(file_digest, _df, _all_holding_df, _cube):
+    """
+    ZIP of the whole analysis for one view, built on the first download click and reused after
+    """
+    summary = {**summarize_account(_all_holding_df, _cube), 'behaviour': behaviour_summary(_all_holding_df, _cube)}
+    return report_bundle(_df, _all_holding_df, _cube, summary)
+
+
+@st.cache_resource(max_entries=4, show_spinner="💹 Reading your prices...")
+def load_prices(price_digest, _price_bytes, file_name):
+    """
+    A parsed price file, once per content hash
+    """
+    return read_prices(io.BytesIO(_price_bytes), file_name)
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def trade_cube(file_digest, _df):
+    """
+    Aggregation cube for an upload, built once per content hash
+    """
+    return cached_frame(file_digest, 'cube', lambda: build_trade_cube(_df))
+
+
+@st.cache_resource(max_entries=32, show_spinner="📚 Adding new fills to your trade history...")
+def ingest_history(account, file_digest, fees_key, _df, _fee_schedule):
+    """
+    Add an upload's new fills to the account's trade store, once per upload and fee schedule
+    """
+    return TradeStore(Path(HISTORY_DIR) / account).ingest(_df, _fee_schedule)
+
+
+@st.cache_resource(max_entries=8, show_spinner="📚 Loading your trade history...")
+def load_history(account, store_digest):
+    """
+    Trades, matched trades, open lots and cube of one version (by TradeStore.digest) of an account's trade store
+    """
+    _, trades, matched, open_lots, cube = TradeStore(Path(HISTORY_DIR) / account).snapshot()
+    return trades, matched, open_lots, cube
+
+
+# 🗓️ Account, period & index filter
+ALL_ACCOUNTS = "👥 All accounts"
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def timeline(file_digest, _df, _all_holding_df):
+    """
+    Trades sorted by execution time and matched trades sorted by exit time, once per upload
+    """
+    trades = _df.sort_values('order_execution_time', kind='mergesort', ignore_index=True)
+    matched = (_all_holding_df.assign(exit_time=exit_times(_all_holding_df))
+               .sort_values('exit_time', kind='mergesort', ignore_index=True))
+    return trades, matched
+
+
+def period_options(trades):
+    """
+    Named date ranges (start, exclusive end) for the period picker; None means a custom range
+    """
+    first_day, last_day = trades['trade_date'].iloc[0], trades['trade_date'].iloc[-1]
+    next_day = last_day + pd.Timedelta(days=1)
+    options = {"🗓️ All time": (None, None)}
+    if 'expiry' in trades.columns:
+        expiries = pd.Series(trades['expiry'].cat.categories)
+        expiries = expiries[expiries <= last_day]
+        if len(expiries):
+            options["🎯 Last expiry week"] = (expiries.max() - pd.Timedelta(days=6), expiries.max() + pd.Timedelta(days=1))
+    options["📆 Last 30 days"] = (next_day - pd.Timedelta(days=30), next_day)
+    for quarter in pd.period_range(first_day, last_day, freq='Q')[::-1]:
+        options[f"📊 {quarter.year} Q{quarter.quarter}"] = (quarter.start_time, (quarter + 1).start_time)
+    options["✏️ Custom range"] = None
+    return options
+
+
+def filter_view(file_digest, df, all_holding_df, cube, inventory):
+    """
+    Sidebar account, period and index filter; returns the sliced trades, matched trades, cube and open lots plus a cache key.
+
+    Every frame is sorted by time, so the period is two binary searches and a
+    positional slice (time_slice) per frame; the index filter then only masks
+    the rows left. Open lots are what is held now, so only the account and
+    index filters apply to them. Sections below cache on the returned key,
+    which is the upload digest when nothing is filtered.
+    """
+    trades, matched = timeline(file_digest, df, all_holding_df)
+    st.sidebar.markdown("### 🗓️ Filter the analysis")
+    accounts = list(trades['account'].cat.categories) if 'account' in trades.columns else []
+    account = ALL_ACCOUNTS
+    if len(accounts) > 1:
+        if st.session_state.get('account_filter') not in accounts:
+            st.session_state.pop('account_filter', None)
+        account = st.sidebar.selectbox("Account", [ALL_ACCOUNTS] + accounts, key='account_filter')
+    options = period_options(trades)
+    if st.session_state.get('period') not in options:
+        st.session_state.pop('period', None)
+    period = st.sidebar.selectbox("Period", list(options), key='period')
+    if options[period] is None:
+        first_day, last_day = trades['trade_date'].iloc[0].date(), trades['trade_date'].iloc[-1].date()
+        picked = st.sidebar.date_input("From / to", value=(first_day, last_day),
+                                       min_value=first_day, max_value=last_day)
+        start, end = pd.Timestamp(picked[0]), pd.Timestamp(picked[-1]) + pd.Timedelta(days=1)
+    else:
+        start, end = options[period]
     
-    # Group by symbol to match buys with sells
-    for symbol, group in trades_df.groupby('symbol'):
-        buys = group[group['trade_type'] == 'buy'].sort_values('order_execution_time')
-        sells = group[group['trade_type'] == 'sell'].sort_values('order_execution_time')
-        
-        # Match buys with sells (simplified: assumes FIFO matching)
-        for buy_idx, buy in buys.iterrows():
-            # Find first sell after this buy
-            subsequent_sells = sells[sells['order_execution_time'] > buy['order_execution_time']]
-            if not subsequent_sells.empty:
-                sell = subsequent_sells.iloc[0]
-                
-                # Calculate holding time in minutes
-                holding_mins = (sell['order_execution_time'] - buy['order_execution_time']).total_seconds() / 60
-                
-                # Calculate PnL for this trade
-                pnl = (sell['price'] - buy['price']) * min(buy['quantity'], sell['quantity'])
-                
-                holding_times.append({
-                    'symbol': symbol,
-                    'buy_time': buy['order_execution_time'],
-                    'sell_time': sell['order_execution_time'],
-                    'holding_minutes': holding_mins,
-                    'pnl': pnl,
-                    'is_winner': pnl > 0
-                })
-                
-                # Remove the matched sell to avoid reusing
-                sells = sells.drop(sell.name)
+    all_indices = sorted(trades['index_name'].dropna().unique())
+    if 'index_filter' in st.session_state:
+        st.session_state.index_filter = [name for name in st.session_state.index_filter if name in all_indices]
+    indices = st.sidebar.multiselect("Indices (all when empty)", all_indices, key='index_filter')
     
-    return pd.DataFrame(holding_times)
+    if start is None and account == ALL_ACCOUNTS and not indices:
+        return trades, matched, cube, inventory, file_digest
+    trades = time_slice(trades, 'order_execution_time', start, end)
+    matched = time_slice(matched, 'exit_time', start, end)
+    cube = time_slice(cube, 'trade_date', start, end)
+    if account != ALL_ACCOUNTS:
+        trades = trades[trades['account'] == account]
+        matched = matched[matched['account'] == account]
+        cube = cube[cube['account'] == account]
+        inventory = inventory[inventory['account'] == account]
+    if indices:
+        trades = trades[trades['index_name'].isin(indices)]
+        matched = matched[matched['index_name'].isin(indices)]
+        cube = cube[cube['index_name'].isin(indices)]
+        inventory = inventory[inventory['index_name'].isin(indices)]
+    return trades, matched, cube, inventory, f"{file_digest}|{account}|{start}|{end}|{','.join(indices)}"
 
-# 📂 File upload
-st.header("📤 Step 1: Upload Your Trading Data")
-uploaded_file = st.file_uploader("Drag & drop your trading CSV file here 👇", type=["csv"])
 
-if uploaded_file is not None:
-    try:
-        try:
-            # 📊 Read data
-            df = pd.read_csv(uploaded_file)
-        except:
-            df = pd.read_xlsx(uploaded_file)
-        with st.expander("🔍 Peek at your raw data (first 5 rows)"):
-            st.dataframe(df.head())
+# 📊 Dashboard sections (fragments rerun on their own when their widgets change)
+LARGE_DATA_ROWS = 5_000  # above this many matched trades the box plot is drawn from quartiles
+DETAIL_COLUMNS = {
+    'symbol': 'Symbol',
+    'buy_time': 'Buy Time',
+    'sell_time': 'Sell Time',
+    'holding_minutes': 'Holding (min)',
+    'pnl': 'PnL'
+}
+DETAIL_PAGE_SIZES = [50, 100, 250, 1000]
+PERFORMANCE_FORMAT = {
+    'win_rate_pct': '{:.1f}%', 'net_pnl': '₹{:,.2f}', 'expectancy': '₹{:,.2f}', 'avg_win': '₹{:,.2f}',
+    'avg_loss': '₹{:,.2f}', 'max_drawdown': '₹{:,.2f}'
+}
+PLANETARY_ADVICE = {
+    "Somvaar": "Shani ka prabhav - Patience rakhein, long-term trades prefer karein",
+    "Mangalvaar": "Mangal grah aggressive - Stop-loss na bhulein!",
+    "Budhvaar": "Budh favorable - Intraday trades ke liye best din",
+    "Guruvaar": "Guru ka ashirwad - New strategies try karne ka shubh samay",
+    "Shukravaar": "Shukra positive - Option buying ke liye achha din"
+}
+
+
+@st.fragment
+def render_planetary_tip():
+    """
+    🪐 Planetary tip picker; choosing a day only reruns this box
+    """
+    selected_day = st.selectbox("Din chunein:", list(PLANETARY_ADVICE.keys()))
+    st.info(f"""
+    {selected_day} ka sujhav:  
+    ✨ *"{PLANETARY_ADVICE[selected_day]}"*  
+    """)
+
+
+def holding_box_figure(stats):
+    """
+    Winners vs losers box plot drawn from holding_box_stats rows
+    """
+    fig = go.Figure()
+    for _, row in stats.sort_values('is_winner').iterrows():
+        fig.add_trace(go.Box(
+            x=["Winners" if row['is_winner'] else "Losers"],
+            q1=[row['q1']], median=[row['median']], q3=[row['q3']], mean=[row['mean']],
+            lowerfence=[row['lowerfence']], upperfence=[row['upperfence']],
+            name=f"{'Winners' if row['is_winner'] else 'Losers'} ({row['count']:,} trades)",
+            marker_color='green' if row['is_winner'] else 'red'
+        ))
+    fig.update_layout(title="Holding Time Distribution: Winners vs Losers",
+                      xaxis_title="Trade Outcome", yaxis_title="Holding Time (minutes)")
+    return fig
+
+
+@st.fragment
+def render_holding_details(holding_df):
+    """
+    📋 Paginated matched-trade table.
+
+    Filtering, sorting and paging happen on the server and only the visible
+    page is styled and sent to the browser, so the cost stays flat as the
+    number of matched trades grows.
+    """
+    detail_columns = DETAIL_COLUMNS | ({'charges': 'Charges'} if 'charges' in holding_df.columns else {})
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        outcome = st.selectbox("Outcome", ["All", "Winners", "Losers"], key="details_outcome")
+    with col2:
+        symbol_filter = st.text_input("Symbol contains", key="details_symbol").strip().upper()
+    with col3:
+        sort_label = st.selectbox("Sort by", list(detail_columns.values()), index=1, key="details_sort")
+    with col4:
+        descending = st.checkbox("Descending", value=False, key="details_descending")
+    
+    with recorder.stage("holding_detail_table") as stage:
+        rows = holding_df
+        if outcome != "All":
+            rows = rows[rows['is_winner'] == (outcome == "Winners")]
+        if symbol_filter:
+            # Match against the unique symbols, then select rows by membership
+            symbols = pd.Series(rows['symbol'].unique())
+            rows = rows[rows['symbol'].isin(symbols[symbols.str.contains(symbol_filter, regex=False)])]
         
-        # 🛠 Data processing
-        st.header("🧹 Step 2: Clean & Prepare Data")
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            page_size = st.selectbox("Rows per page", DETAIL_PAGE_SIZES, key="details_page_size")
+            requested_page = st.number_input("Page", min_value=1, value=1, step=1, key="details_page")
+        sort_by = next(col for col, label in detail_columns.items() if label == sort_label)
+        page_df, page, pages = sorted_page(rows, sort_by, not descending, requested_page, page_size)
         
-        # Check required columns
-        required_columns = ['symbol', 'order_execution_time', 'trade_type', 'quantity', 'price']
-        missing_cols = [col for col in required_columns if col not in df.columns]
+        detailed_holdings = page_df[list(detail_columns)].copy()
+        detailed_holdings['holding_minutes'] = detailed_holdings['holding_minutes'].round(1)
+        detailed_holdings['pnl'] = detailed_holdings['pnl'].round(2)
+        detailed_holdings.columns = list(detail_columns.values())
+        with col2:
+            st.caption(f"Page {page} of {pages} · {len(rows):,} matched trades")
+            st.dataframe(detailed_holdings.style.format({'PnL': '{:.2f}', 'Charges': '{:.2f}'})
+                        .map(lambda x: 'color: green' if x > 0 else 'color: red', subset=['PnL']))
+        stage['rows'] = len(detailed_holdings)
+
+
+def equity_figure(curve, title):
+    """
+    Realized equity (top) and drawdown (bottom) over exit time, drawn with WebGL
+    """
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.7, 0.3], vertical_spacing=0.05)
+    fig.add_trace(go.Scattergl(x=curve['exit_time'], y=curve['equity'], mode='lines', name='Realized PnL',
+                               line={'color': 'green'}), row=1, col=1)
+    fig.add_trace(go.Scattergl(x=curve['exit_time'], y=curve['drawdown'], mode='lines', name='Drawdown',
+                               fill='tozeroy', line={'color': 'red'}), row=2, col=1)
+    fig.update_layout(title=title, showlegend=False)
+    fig.update_yaxes(title_text="PnL (₹)", row=1, col=1)
+    fig.update_yaxes(title_text="Drawdown (₹)", row=2, col=1)
+    return fig
+
+
+def show_performance_metrics(stats):
+    """
+    Expectancy, max drawdown and streak metrics from one performance_stats row
+    """
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("💸 Expectancy / Trade", f"₹{stats['expectancy']:,.2f}")
+    with col2:
+        st.metric("📉 Max Drawdown", f"₹{stats['max_drawdown']:,.2f}")
+    with col3:
+        st.metric("🥶 Longest Losing Streak", f"{int(stats['longest_loss_streak'])} trades")
+    with col4:
+        st.metric("🔥 Longest Winning Streak", f"{int(stats['longest_win_streak'])} trades")
+
+
+def pick_index(index_name):
+    """
+    "Analyze next" button callback: switch the index picker to `index_name`
+    """
+    st.session_state.selected_index = index_name
+
+
+@st.fragment
+def render_index_dashboard(df, file_digest, all_holding_df, cube):
+    """
+    Step 3 and the per-index dashboard.
+
+    Runs as a fragment, so picking another index only reruns this section and
+    not the upload or the all-indices analysis.
+    """
+    # 🎯 Index selection section
+    st.header("🎯 Step 3: Pick Your Index")
+    all_indices = df['index_name'].unique()
+    if st.session_state.get('selected_index') not in all_indices:
+        st.session_state.pop('selected_index', None)
+    selected_index = st.selectbox(
+        "Which index do you want to analyze?",
+        all_indices,
+        key="selected_index"
+    )
+    
+    # Track analyzed indices
+    st.session_state.symbols_analyzed.add(selected_index)
+    
+    index_cube = cube[cube['index_name'] == selected_index]
+    
+    # 🏆 Performance dashboard
+    st.header(f"🏆 {selected_index} Performance Dashboard")
+    
+    # 📈 Quick stats
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        total_trades = index_cube['trade_count'].sum()
+        st.metric("📊 Total Trades", total_trades)
+    
+    with col2:
+        buy_volume = index_cube[index_cube['trade_type'] == 'buy']['quantity'].sum()
+        st.metric("🛒 Buy Volume", buy_volume)
+    
+    with col3:
+        sell_volume = index_cube[index_cube['trade_type'] == 'sell']['quantity'].sum()
+        st.metric("💰 Sell Volume", sell_volume)
+    
+    # 📊 PnL analysis
+    st.subheader("💹 Profit & Loss Breakdown")
+    
+    pnl_df = side_summary(index_cube)
+    
+    st.dataframe(pnl_df.style.format({col: '{:.2f}' for col in ('avg_price', 'total_value', 'charges')
+                                      if col in pnl_df.columns}))
+    
+    # =============================================
+    # ⏱️ HOLDING TIME ANALYSIS (NOW IN CORRECT LOCATION)
+    # =============================================
+    st.subheader("⏱️ Average Holding Time Analysis")
+    
+    # Slice the per-upload matched trades for the selected index
+    holding_df = all_holding_df[all_holding_df['index_name'] == selected_index]
+    
+    if not holding_df.empty:
+        # Calculate average holding times
+        avg_holding_winner = holding_df[holding_df['is_winner']]['holding_minutes'].mean()
+        avg_holding_loser = holding_df[~holding_df['is_winner']]['holding_minutes'].mean()
         
-        if missing_cols:
-            st.error(f"🚨 Oops! Missing columns: {', '.join(missing_cols)}")
-        else:
-            # Extract index name from symbol (e.g., "FINNIFTY2440221300PE" → "FINNIFTY")
-            df['index_name'] = df['symbol'].apply(lambda x: re.sub(r'\d+.*', '', x))
-            
-            # Convert order_execution_time to datetime
-            df['order_execution_time'] = pd.to_datetime(df['order_execution_time'])
-            
-            # Calculate values
-            df['trade_value'] = df['quantity'] * df['price']
-            df['trade_hour'] = df['order_execution_time'].dt.hour
-            df['trade_date_only'] = df['order_execution_time'].dt.date
-            
-            # Create proper day of week columns
-            df['trade_weekday'] = df['order_execution_time'].dt.dayofweek  # Monday=0, Sunday=6
-            df['trade_day_name'] = df['order_execution_time'].dt.day_name()  # Full day name
-            
-            # 🎯 Index selection section
-            st.header("🎯 Step 3: Pick Your Index")
-            all_indices = df['index_name'].unique()
-            selected_index = st.selectbox(
-                "Which index do you want to analyze?",
-                all_indices,
-                index=0
-            )
-            
-            # Track analyzed indices
-            st.session_state.symbols_analyzed.add(selected_index)
-            
-            # Filter data for selected index
-            index_df = df[df['index_name'] == selected_index]
-            
-            # 🏆 Performance dashboard
-            st.header(f"🏆 {selected_index} Performance Dashboard")
-            
-            # 📈 Quick stats
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                total_trades = len(index_df)
-                st.metric("📊 Total Trades", total_trades)
-            
-            with col2:
-                buy_volume = index_df[index_df['trade_type'] == 'buy']['quantity'].sum()
-                st.metric("🛒 Buy Volume", buy_volume)
-            
-            with col3:
-                sell_volume = index_df[index_df['trade_type'] == 'sell']['quantity'].sum()
-                st.metric("💰 Sell Volume", sell_volume)
-            
-            # 📊 PnL analysis
-            st.subheader("💹 Profit & Loss Breakdown")
-            
-            pnl_df = index_df.groupby('trade_type').agg(
-                total_quantity=('quantity', 'sum'),
-                avg_price=('price', 'mean'),
-                total_value=('trade_value', 'sum'),
-                trade_count=('trade_type', 'count')
-            ).reset_index()
-            
-            st.dataframe(pnl_df.style.format({
-                'avg_price': '{:.2f}',
-                'total_value': '{:.2f}'
-            }))
-            
-            # =============================================
-            # ⏱️ HOLDING TIME ANALYSIS (NOW IN CORRECT LOCATION)
-            # =============================================
-            st.subheader("⏱️ Average Holding Time Analysis")
-            
-            # Calculate holding times for the selected index
-            holding_df = calculate_holding_times(index_df)
-            
-            if not holding_df.empty:
-                # Calculate average holding times
-                avg_holding_winner = holding_df[holding_df['is_winner']]['holding_minutes'].mean()
-                avg_holding_loser = holding_df[~holding_df['is_winner']]['holding_minutes'].mean()
-                
-                col1, col2, col3, col4 = st.columns(4)
-                
-                with col1:
-                    st.metric("✅ Winning Trades", len(holding_df[holding_df['is_winner']]))
-                with col2:
-                    st.metric("❌ Losing Trades", len(holding_df[~holding_df['is_winner']]))
-                with col3:
-                    if pd.notna(avg_holding_winner):
-                        st.metric("⏱️ Avg Hold Time (Winners)", f"{avg_holding_winner:.1f} min")
-                    else:
-                        st.metric("⏱️ Avg Hold Time (Winners)", "No data")
-                with col4:
-                    if pd.notna(avg_holding_loser):
-                        st.metric("⏱️ Avg Hold Time (Losers)", f"{avg_holding_loser:.1f} min")
-                    else:
-                        st.metric("⏱️ Avg Hold Time (Losers)", "No data")
-                
-                # Visualization
-                if len(holding_df) > 0:
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            st.metric("✅ Winning Trades", len(holding_df[holding_df['is_winner']]))
+        with col2:
+            st.metric("❌ Losing Trades", len(holding_df[~holding_df['is_winner']]))
+        with col3:
+            if pd.notna(avg_holding_winner):
+                st.metric("⏱️ Avg Hold Time (Winners)", f"{avg_holding_winner:.1f} min")
+            else:
+                st.metric("⏱️ Avg Hold Time (Winners)", "No data")
+        with col4:
+            if pd.notna(avg_holding_loser):
+                st.metric("⏱️ Avg Hold Time (Losers)", f"{avg_holding_loser:.1f} min")
+            else:
+                st.metric("⏱️ Avg Hold Time (Losers)", "No data")
+        
+        # Visualization
+        if len(holding_df) > 0:
+            with recorder.stage("holding_box_plot") as stage:
+                if len(holding_df) > LARGE_DATA_ROWS:
+                    # Large book: draw the boxes from precomputed quartiles and whiskers
+                    index_stats = box_stats(file_digest, all_holding_df)
+                    fig = holding_box_figure(index_stats[index_stats['index_name'] == selected_index])
+                else:
                     fig = px.box(holding_df, 
                                  x='is_winner', 
                                  y='holding_minutes',
@@ -228,316 +671,608 @@ if uploaded_file is not None:
                     # Add custom x-axis labels
                     fig.update_xaxes(ticktext=["Losers", "Winners"], 
                                     tickvals=[False, True])
-                    
-                    st.plotly_chart(fig, use_container_width=True)
-                    
-                    # 📊 Detailed holding time table
-                    with st.expander("📋 View Detailed Holding Times"):
-                        detailed_holdings = holding_df[['symbol', 'buy_time', 'sell_time', 'holding_minutes', 'pnl']].copy()
-                        detailed_holdings['holding_minutes'] = detailed_holdings['holding_minutes'].round(1)
-                        detailed_holdings['pnl'] = detailed_holdings['pnl'].round(2)
-                        detailed_holdings.columns = ['Symbol', 'Buy Time', 'Sell Time', 'Holding (min)', 'PnL']
-                        st.dataframe(detailed_holdings.style.format({'PnL': '{:.2f}'})
-                                    .applymap(lambda x: 'color: green' if x > 0 else 'color: red', subset=['PnL']))
-                    
-                    # 🎯 Trading Insight based on holding times
-                    st.subheader("🎯 Your Trading Pattern Insight")
-                    
-                    if pd.notna(avg_holding_winner) and pd.notna(avg_holding_loser):
-                        if avg_holding_winner < avg_holding_loser:
-                            st.warning(f"""
-                            ⚠️ **Pattern Alert!** You hold your **losing trades** ({avg_holding_loser:.1f} min) 
-                            longer than your **winning trades** ({avg_holding_winner:.1f} min). 
-                            
-                            💡 **Suggestion:** Try to cut losses faster. Consider stricter stop-losses!
-                            """)
-                        elif avg_holding_winner > avg_holding_loser:
-                            st.success(f"""
-                            ✨ **Excellent!** You hold your **winning trades** longer ({avg_holding_winner:.1f} min) 
-                            than your **losing trades** ({avg_holding_loser:.1f} min). 
-                            
-                            🌟 **Perfect!** This is the trader's ideal - let winners run, cut losers short!
-                            """)
-                        else:
-                            st.info("Your holding times are similar for winners and losers. Try to let winners run longer!")
-            else:
-                st.info("📭 Not enough matched buy-sell pairs to calculate holding times. Make sure you have both buy and sell trades for the same symbols.")
-            
-            # =============================================
-            # 🕒 TIME-BASED ANALYSIS (Index Specific)
-            # =============================================
-            st.subheader("⏰ Time-Based Performance")
-            
-            # Day of week analysis
-            st.markdown("#### 📅 Day of Week Analysis")
-            
-            # Group by weekday number and day name together
-            dow_pnl = index_df.groupby(['trade_weekday', 'trade_day_name', 'trade_type'])['trade_value'].sum().unstack()
-            
-            if 'buy' in dow_pnl.columns and 'sell' in dow_pnl.columns:
-                dow_pnl['dow_pnl'] = dow_pnl['sell'] - dow_pnl['buy']
-                
-                # Sort by weekday number (Monday=0 to Sunday=6)
-                dow_pnl = dow_pnl.sort_index(level='trade_weekday')
-                
-                # Get day names in correct order for display
-                day_names = dow_pnl.index.get_level_values('trade_day_name').unique()
                 
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    fig = px.bar(dow_pnl.reset_index(), 
-                                x='trade_day_name', 
-                                y='dow_pnl',
-                                title=f"PnL by Day of Week",
-                                color='dow_pnl',
-                                color_continuous_scale='RdYlGn',
-                                category_orders={"trade_day_name": list(day_names)})
-                    st.plotly_chart(fig, use_container_width=True)
-                
-                with col2:
-                    best_day = dow_pnl['dow_pnl'].idxmax()[1]  # Get day name from multi-index
-                    worst_day = dow_pnl['dow_pnl'].idxmin()[1]
-                    st.metric("⭐ Best Day", best_day)
-                    st.metric("💔 Worst Day", worst_day)
-                    st.dataframe(dow_pnl[['buy', 'sell', 'dow_pnl']].style.format("{:.2f}"))
-
-                # =========================================
-                # 🔴 Mangal Dosh Warning (Dynamic Alert)
-                # =========================================
-                # Fix the Mangal Dosh check
-                day_names_lower = [name.lower() for name in day_names]
-                tuesday_idx = None
-                for i, name in enumerate(day_names):
-                    if 'tuesday' in name.lower() or 'mangal' in name.lower():
-                        tuesday_idx = i
-                        break
-                
-                if tuesday_idx is not None:
-                    tuesday_pnl = dow_pnl.iloc[tuesday_idx]['dow_pnl']
-                    if tuesday_pnl < 0:
-                        loss_percent = abs(tuesday_pnl) / dow_pnl['dow_pnl'].abs().sum() * 100
-                        
-                        st.warning(f"""
-                        🔴 **Mangal Ka Prabhav!**  
-                        Aapke {selected_index} trades mein:  
-                        - Mangalvaar (Tuesday) ko sabse zyada nuksaan hua: **₹{abs(tuesday_pnl):,.0f}**  
-                        - Ye aapke kul nuksaan ka **{loss_percent:.0f}%** hai  
-
-                        💡 *Panditji ka sujhav:*  
-                        "Mangalvaar ko trade avoid karein, ya stop-loss zaroor lagayein!"  
-                        """, icon="⚠️")
-                        
-                        # Add astrological GIF
-                        st.image("https://i.gifer.com/7IAj.gif", width=200, 
-                                 caption="Mangal grah aapke trades ko prabhavit kar raha hai")
-
-                # =========================================
-                # 🪐 Grah Anusaar Trading Tips (Planetary Advice)
-                # =========================================
-                st.subheader("🪐 Grah Anusaar Trading Tips")
-
-                planetary_advice = {
-                    "Somvaar": "Shani ka prabhav - Patience rakhein, long-term trades prefer karein",
-                    "Mangalvaar": "Mangal grah aggressive - Stop-loss na bhulein!",
-                    "Budhvaar": "Budh favorable - Intraday trades ke liye best din",
-                    "Guruvaar": "Guru ka ashirwad - New strategies try karne ka shubh samay",
-                    "Shukravaar": "Shukra positive - Option buying ke liye achha din"
-                }
-
-                selected_day = st.selectbox("Din chunein:", list(planetary_advice.keys()))
-                st.info(f"""
-                {selected_day} ka sujhav:  
-                ✨ *"{planetary_advice[selected_day]}"*  
-                """)
-            
-            # Hourly analysis
-            st.markdown("#### 🕒 Hour of Day Analysis")
-            hour_pnl = index_df.groupby(['trade_hour', 'trade_type'])['trade_value'].sum().unstack()
-            
-            if 'buy' in hour_pnl.columns and 'sell' in hour_pnl.columns:
-                hour_pnl['hour_pnl'] = hour_pnl['sell'] - hour_pnl['buy']
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    fig = px.bar(hour_pnl.reset_index(), 
-                                x='trade_hour', 
-                                y='hour_pnl',
-                                title=f"PnL by Execution Hour",
-                                color='hour_pnl',
-                                color_continuous_scale='RdYlGn')
-                    st.plotly_chart(fig, use_container_width=True)
-                
-                with col2:
-                    best_hour = hour_pnl['hour_pnl'].idxmax()
-                    worst_hour = hour_pnl['hour_pnl'].idxmin()
-                    st.metric("⏰ Best Hour", f"{best_hour}:00")
-                    st.metric("👎 Worst Hour", f"{worst_hour}:00")
-                    st.dataframe(hour_pnl[['buy', 'sell', 'hour_pnl']].style.format("{:.2f}"))
-            
-            # 🎁 Results summary
-            total_pnl = pnl_df[pnl_df['trade_type'] == 'sell']['total_value'].sum() - pnl_df[pnl_df['trade_type'] == 'buy']['total_value'].sum()
-            
-            if total_pnl > 0:
-                st.balloons()
-                st.success(f"🎉 Congratulations! You made ₹{total_pnl:,.2f} on {selected_index}!")
-            else:
-                st.warning(f"🤕 Ouch! You lost ₹{abs(total_pnl):,.2f} on {selected_index}. Better luck next time!")
-            
-            # 🏆 Check for new badges
-            new_badges = check_badges(len(st.session_state.symbols_analyzed), total_pnl)
-            if new_badges:
-                st.session_state.badges.extend(new_badges)
-                with st.expander("🎖️ New Achievement Unlocked!", expanded=True):
-                    for badge in new_badges:
-                        st.success(f"🏅 You earned the {badge} badge!")
-                        time.sleep(1)
-            
-            # 🎮 Gamification
-            st.subheader("🏆 Your Trading Profile")
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.metric("📌 Indices Analyzed", len(st.session_state.symbols_analyzed))
-                st.metric("📅 Days Active", st.session_state.visit_count // 2)
-                
-            with col2:
-                if st.session_state.badges:
-                    st.write("🎖️ Your Badges:")
-                    for badge in st.session_state.badges:
-                        st.write(f"- {badge}")
-                else:
-                    st.info("🔍 Analyze more indices to earn badges!")
-            
-            # 🔄 Analyze another suggestion
-            if len(all_indices) > 1:
-                st.subheader("🔍 Try Another Index")
-                other_indices = [s for s in all_indices if s != selected_index]
-                next_index = random.choice(other_indices)
-                if st.button(f"🧐 Analyze {next_index} next"):
-                    st.rerun()  # Updated from experimental_rerun
-            
-            # =============================================
-            # 🌍 COMPLETE ANALYSIS SECTION (ALL INDICES)
-            # =============================================
-            st.markdown("---")
-            st.header("🌍 Complete Analysis (All Indices)")
-            
-            # Overall stats
-            st.subheader("📊 Overall Performance")
-            
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("📌 Total Indices Traded", len(df['index_name'].unique()))
-            with col2:
-                st.metric("🔄 Total Trades", len(df))
-            with col3:
-                total_pnl_all = df[df['trade_type'] == 'sell']['trade_value'].sum() - df[df['trade_type'] == 'buy']['trade_value'].sum()
-                st.metric("💰 Net PnL (All)", f"₹{total_pnl_all:,.2f}")
+                st.plotly_chart(fig, use_container_width=True)
+                stage['rows'] = len(holding_df)
             
-            # Add Overall Holding Time Analysis
-            st.subheader("⏱️ Overall Holding Time Analysis (All Indices)")
+            # 📊 Detailed holding time table
+            with st.expander("📋 View Detailed Holding Times"):
+                render_holding_details(holding_df)
             
-            overall_holding_df = calculate_holding_times(df)
+            # 🎯 Trading Insight based on holding times
+            st.subheader("🎯 Your Trading Pattern Insight")
             
-            if not overall_holding_df.empty:
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    avg_winner_all = overall_holding_df[overall_holding_df['is_winner']]['holding_minutes'].mean()
-                    avg_loser_all = overall_holding_df[~overall_holding_df['is_winner']]['holding_minutes'].mean()
+            if pd.notna(avg_holding_winner) and pd.notna(avg_holding_loser):
+                if avg_holding_winner < avg_holding_loser:
+                    st.warning(f"""
+                    ⚠️ **Pattern Alert!** You hold your **losing trades** ({avg_holding_loser:.1f} min) 
+                    longer than your **winning trades** ({avg_holding_winner:.1f} min). 
                     
-                    st.metric("📊 Overall Avg Hold - Winners", f"{avg_winner_all:.1f} min" if pd.notna(avg_winner_all) else "N/A")
-                    st.metric("📊 Overall Avg Hold - Losers", f"{avg_loser_all:.1f} min" if pd.notna(avg_loser_all) else "N/A")
-                
-                with col2:
-                    # Summary stats
-                    winner_pct = (overall_holding_df['is_winner'].sum() / len(overall_holding_df)) * 100
-                    st.metric("🎯 Win Rate", f"{winner_pct:.1f}%")
+                    💡 **Suggestion:** Try to cut losses faster. Consider stricter stop-losses!
+                    """)
+                elif avg_holding_winner > avg_holding_loser:
+                    st.success(f"""
+                    ✨ **Excellent!** You hold your **winning trades** longer ({avg_holding_winner:.1f} min) 
+                    than your **losing trades** ({avg_holding_loser:.1f} min). 
                     
-                    total_trades_analyzed = len(overall_holding_df)
-                    st.metric("🔄 Matched Trades", total_trades_analyzed)
-            
-            # Day of week analysis (all indices)
-            st.subheader("📅 Best Days to Trade (All Indices)")
-            
-            dow_all = df.groupby(['trade_weekday', 'trade_day_name', 'trade_type'])['trade_value'].sum().unstack()
-            if 'buy' in dow_all.columns and 'sell' in dow_all.columns:
-                dow_all['dow_pnl'] = dow_all['sell'] - dow_all['buy']
-                dow_all = dow_all.sort_index(level='trade_weekday')
-                
-                # Get ordered day names
-                day_names_all = dow_all.index.get_level_values('trade_day_name').unique()
-                
-                fig = px.bar(dow_all.reset_index(), 
-                            x='trade_day_name', 
-                            y='dow_pnl',
-                            title="Overall PnL by Day of Week",
-                            color='dow_pnl',
-                            color_continuous_scale='RdYlGn',
-                            category_orders={"trade_day_name": list(day_names_all)})
-                st.plotly_chart(fig, use_container_width=True)
+                    🌟 **Perfect!** This is the trader's ideal - let winners run, cut losers short!
+                    """)
+                else:
+                    st.info("Your holding times are similar for winners and losers. Try to let winners run longer!")
+    else:
+        st.info("📭 Not enough matched buy-sell pairs to calculate holding times. Make sure you have both buy and sell trades for the same symbols.")
+    
+    # 📈 Equity curve, drawdown & streaks
+    if not holding_df.empty:
+        st.subheader("📈 Equity Curve & Drawdown")
+        with recorder.stage("equity_curve") as stage:
+            perf = performance(file_digest, all_holding_df)
+            show_performance_metrics(perf['stats'][perf['stats']['index_name'] == selected_index].iloc[0])
+            index_curve = perf['curves'][selected_index]
+            st.plotly_chart(equity_figure(index_curve, f"{selected_index}: Realized PnL & Drawdown"),
+                            use_container_width=True)
+            stage['rows'] = len(index_curve)
+    
+    # =============================================
+    # 🕒 TIME-BASED ANALYSIS (Index Specific)
+    # =============================================
+    st.subheader("⏰ Time-Based Performance")
+    
+    # Day of week analysis
+    st.markdown("#### 📅 Day of Week Analysis")
+    
+    # Group by weekday number and day name together
+    dow_pnl = rollup_pnl(index_cube, ['trade_weekday', 'trade_day_name'])
+    
+    if 'buy' in dow_pnl.columns and 'sell' in dow_pnl.columns:
+        dow_pnl['dow_pnl'] = net_pnl(dow_pnl)
+        
+        # Sort by weekday number (Monday=0 to Sunday=6)
+        dow_pnl = dow_pnl.sort_index(level='trade_weekday')
+        
+        # Get day names in correct order for display
+        day_names = dow_pnl.index.get_level_values('trade_day_name').unique()
+        
+        col1, col2 = st.columns(2)
+        
+        with col1, recorder.stage("day_of_week_chart") as stage:
+            fig = px.bar(dow_pnl.reset_index(), 
+                        x='trade_day_name', 
+                        y='dow_pnl',
+                        title=f"PnL by Day of Week",
+                        color='dow_pnl',
+                        color_continuous_scale='RdYlGn',
+                        category_orders={"trade_day_name": list(day_names)})
+            st.plotly_chart(fig, use_container_width=True)
+            stage['rows'] = len(dow_pnl)
+        
+        with col2:
+            best_day = dow_pnl['dow_pnl'].idxmax()[1]  # Get day name from multi-index
+            worst_day = dow_pnl['dow_pnl'].idxmin()[1]
+            st.metric("⭐ Best Day", best_day)
+            st.metric("💔 Worst Day", worst_day)
+            st.dataframe(dow_pnl.filter(['buy', 'sell', 'charges', 'dow_pnl']).style.format("{:.2f}"))
+
+        # =========================================
+        # 🔴 Mangal Dosh Warning (Dynamic Alert)
+        # =========================================
+        # Fix the Mangal Dosh check
+        day_names_lower = [name.lower() for name in day_names]
+        tuesday_idx = None
+        for i, name in enumerate(day_names):
+            if 'tuesday' in name.lower() or 'mangal' in name.lower():
+                tuesday_idx = i
+                break
+        
+        if tuesday_idx is not None:
+            tuesday_pnl = dow_pnl.iloc[tuesday_idx]['dow_pnl']
+            if tuesday_pnl < 0:
+                loss_percent = abs(tuesday_pnl) / dow_pnl['dow_pnl'].abs().sum() * 100
                 
-                best_day_all = dow_all['dow_pnl'].idxmax()[1]
-                worst_day_all = dow_all['dow_pnl'].idxmin()[1]
+                st.warning(f"""
+                🔴 **Mangal Ka Prabhav!**  
+                Aapke {selected_index} trades mein:  
+                - Mangalvaar (Tuesday) ko sabse zyada nuksaan hua: **₹{abs(tuesday_pnl):,.0f}**  
+                - Ye aapke kul nuksaan ka **{loss_percent:.0f}%** hai  
+
+                💡 *Panditji ka sujhav:*  
+                "Mangalvaar ko trade avoid karein, ya stop-loss zaroor lagayein!"  
+                """, icon="⚠️")
                 
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.metric("⭐ Overall Best Day", best_day_all)
-                with col2:
-                    st.metric("💔 Overall Worst Day", worst_day_all)
+                # Add astrological GIF
+                st.image("https://i.gifer.com/7IAj.gif", width=200, 
+                         caption="Mangal grah aapke trades ko prabhavit kar raha hai")
+
+        # =========================================
+        # 🪐 Grah Anusaar Trading Tips (Planetary Advice)
+        # =========================================
+        st.subheader("🪐 Grah Anusaar Trading Tips")
+        render_planetary_tip()
+    
+    # Hourly analysis
+    st.markdown("#### 🕒 Hour of Day Analysis")
+    hour_pnl = rollup_pnl(index_cube, ['trade_hour'])
+    
+    if 'buy' in hour_pnl.columns and 'sell' in hour_pnl.columns:
+        hour_pnl['hour_pnl'] = net_pnl(hour_pnl)
+        
+        col1, col2 = st.columns(2)
+        
+        with col1, recorder.stage("hour_chart") as stage:
+            fig = px.bar(hour_pnl.reset_index(), 
+                        x='trade_hour', 
+                        y='hour_pnl',
+                        title=f"PnL by Execution Hour",
+                        color='hour_pnl',
+                        color_continuous_scale='RdYlGn')
+            st.plotly_chart(fig, use_container_width=True)
+            stage['rows'] = len(hour_pnl)
+        
+        with col2:
+            best_hour = hour_pnl['hour_pnl'].idxmax()
+            worst_hour = hour_pnl['hour_pnl'].idxmin()
+            st.metric("⏰ Best Hour", f"{best_hour}:00")
+            st.metric("👎 Worst Hour", f"{worst_hour}:00")
+            st.dataframe(hour_pnl.filter(['buy', 'sell', 'charges', 'hour_pnl']).style.format("{:.2f}"))
+    
+    # 🎁 Results summary
+    total_pnl = pnl_table(index_cube, ['index_name'])['pnl'].sum()
+    
+    if total_pnl > 0:
+        st.balloons()
+        st.success(f"🎉 Congratulations! You made ₹{total_pnl:,.2f} on {selected_index}!")
+    else:
+        st.warning(f"🤕 Ouch! You lost ₹{abs(total_pnl):,.2f} on {selected_index}. Better luck next time!")
+    
+    # 🏆 Check for new badges
+    new_badges = check_badges(len(st.session_state.symbols_analyzed), total_pnl)
+    if new_badges:
+        st.session_state.badges.extend(new_badges)
+        with st.expander("🎖️ New Achievement Unlocked!", expanded=True):
+            for badge in new_badges:
+                st.success(f"🏅 You earned the {badge} badge!")
+    
+    # 🎮 Gamification
+    st.subheader("🏆 Your Trading Profile")
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.metric("📌 Indices Analyzed", len(st.session_state.symbols_analyzed))
+        st.metric("📅 Days Active", st.session_state.visit_count // 2)
+        
+    with col2:
+        if st.session_state.badges:
+            st.write("🎖️ Your Badges:")
+            for badge in st.session_state.badges:
+                st.write(f"- {badge}")
+        else:
+            st.info("🔍 Analyze more indices to earn badges!")
+    
+    # 🔄 Analyze another suggestion
+    if len(all_indices) > 1:
+        st.subheader("🔍 Try Another Index")
+        other_indices = [s for s in all_indices if s != selected_index]
+        next_index = random.choice(other_indices)
+        st.button(f"🧐 Analyze {next_index} next", on_click=pick_index, args=(next_index,))
+
+
+@st.fragment
+def render_behaviour_patterns(cube, file_digest, all_holding_df):
+    """
+    🧠 Revenge trading, size escalation after losses and overtrading days
+    """
+    st.subheader("🧠 Behaviour Patterns That Cost You Money")
+    col1, col2 = st.columns(2)
+    with col1:
+        revenge_minutes = st.slider("😤 Revenge window (minutes after closing a loss)", 1, 120, 15)
+    with col2:
+        spike_threshold = st.slider("🌪️ Overtrading: fills vs your usual day", 1.5, 5.0, 2.0, step=0.5)
+    
+    with recorder.stage("behaviour_patterns") as stage:
+        trips = trips_of(file_digest, all_holding_df)
+        revenge = flag_revenge_trades(trips, revenge_minutes)['is_revenge'].to_numpy()
+        escalation = flag_size_escalation(trips)['is_escalation'].to_numpy()
+        days = flag_overtrading_days(cube, all_holding_df, threshold=spike_threshold)
+        spikes = days['is_spike'].to_numpy()
+        stage['rows'] = len(trips)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("😤 Revenge Trades", f"{revenge.sum():,}", f"₹{trips.loc[revenge, 'pnl'].sum():,.2f}")
+    with col2:
+        st.metric("📈 Bigger Size After a Loss", f"{escalation.sum():,}", f"₹{trips.loc[escalation, 'pnl'].sum():,.2f}")
+    with col3:
+        st.metric("🌪️ Overtrading Days", f"{spikes.sum():,}", f"₹{days.loc[spikes, 'pnl'].sum():,.2f}")
+    
+    if revenge.any() and (~revenge).any():
+        revenge_win_rate = trips.loc[revenge, 'is_winner'].mean() * 100
+        other_win_rate = trips.loc[~revenge, 'is_winner'].mean() * 100
+        if revenge_win_rate < other_win_rate:
+            st.warning(f"""
+            😤 **Badla Mode!** Trades taken within {revenge_minutes} min of a loss win only **{revenge_win_rate:.1f}%** 
+            of the time, against **{other_win_rate:.1f}%** for your other trades.
             
-            # Hourly analysis (all indices)
-            st.subheader("🕒 Best Execution Times (All Indices)")
+            💡 *Panditji ka sujhav:* "Loss ke baad chai break lo, turant wapas mat kudo!"
+            """)
+        else:
+            st.success(f"🧘 Trades after a loss win {revenge_win_rate:.1f}% of the time (vs {other_win_rate:.1f}%) - no revenge streak here!")
+    if spikes.any() and (~spikes).any():
+        st.info(f"🌪️ On overtrading days you average **₹{days.loc[spikes, 'pnl'].mean():,.2f}**, "
+                f"against **₹{days.loc[~spikes, 'pnl'].mean():,.2f}** on normal days.")
+    
+    if len(days):
+        fig = px.bar(days, x='trade_date', y='fills', color='is_spike',
+                     color_discrete_map={True: 'red', False: 'lightblue'},
+                     title="Fills per Day (red = more than usual)",
+                     labels={'trade_date': 'Day', 'fills': 'Fills', 'is_spike': 'Overtrading'})
+        fig.add_scatter(x=days['trade_date'], y=days['baseline'] * spike_threshold, mode='lines',
+                        name='Overtrading line', line={'color': 'orange', 'dash': 'dash'})
+        st.plotly_chart(fig, use_container_width=True)
+
+
+def render_complete_analysis(df, file_digest, all_holding_df, cube):
+    """
+    Complete Analysis (All Indices), which does not depend on the index picker
+    """
+    st.markdown("---")
+    st.header("🌍 Complete Analysis (All Indices)")
+    
+    # Overall stats
+    st.subheader("📊 Overall Performance")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("📌 Total Indices Traded", cube['index_name'].nunique())
+    with col2:
+        st.metric("🔄 Total Trades", len(df))
+    with col3:
+        pnl_all = pnl_table(cube, ['index_name']).sum()
+        # With charges on, the delta shows what they took out of the gross PnL
+        st.metric("💰 Net PnL (All)", f"₹{pnl_all['pnl']:,.2f}",
+                  delta=f"-₹{pnl_all['charges']:,.2f} charges" if 'charges' in pnl_all else None)
+    
+    # Add Overall Holding Time Analysis
+    st.subheader("⏱️ Overall Holding Time Analysis (All Indices)")
+    
+    overall_holding_df = all_holding_df
+    
+    if not overall_holding_df.empty:
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            avg_winner_all = overall_holding_df[overall_holding_df['is_winner']]['holding_minutes'].mean()
+            avg_loser_all = overall_holding_df[~overall_holding_df['is_winner']]['holding_minutes'].mean()
             
-            hour_all = df.groupby(['trade_hour', 'trade_type'])['trade_value'].sum().unstack()
-            if 'buy' in hour_all.columns and 'sell' in hour_all.columns:
-                hour_all['hour_pnl'] = hour_all['sell'] - hour_all['buy']
-                
-                fig = px.bar(hour_all.reset_index(), 
-                            x='trade_hour', 
-                            y='hour_pnl',
-                            title="Overall PnL by Execution Hour",
-                            color='hour_pnl',
-                            color_continuous_scale='RdYlGn')
-                st.plotly_chart(fig, use_container_width=True)
-                
-                best_hour_all = hour_all['hour_pnl'].idxmax()
-                worst_hour_all = hour_all['hour_pnl'].idxmin()
-                
+            st.metric("📊 Overall Avg Hold - Winners", f"{avg_winner_all:.1f} min" if pd.notna(avg_winner_all) else "N/A")
+            st.metric("📊 Overall Avg Hold - Losers", f"{avg_loser_all:.1f} min" if pd.notna(avg_loser_all) else "N/A")
+        
+        with col2:
+            # Summary stats
+            winner_pct = (overall_holding_df['is_winner'].sum() / len(overall_holding_df)) * 100
+            st.metric("🎯 Win Rate", f"{winner_pct:.1f}%")
+            
+            total_trades_analyzed = len(overall_holding_df)
+            st.metric("🔄 Matched Trades", total_trades_analyzed)
+        
+        # 📈 Overall equity curve and per-index streak stats
+        st.subheader("📈 Overall Equity Curve & Drawdown")
+        perf = performance(file_digest, overall_holding_df)
+        show_performance_metrics(perf['overall'].iloc[0])
+        st.plotly_chart(equity_figure(perf['overall_curve'], "All Indices: Realized PnL & Drawdown"),
+                        use_container_width=True)
+        st.dataframe(perf['stats'].set_index('index_name').style.format(PERFORMANCE_FORMAT),
+                     use_container_width=True)
+        
+        # 👥 Side by side when several accounts are combined
+        if perf['account_stats'] is not None and len(perf['account_stats']) > 1:
+            st.subheader("👥 Account Comparison")
+            st.dataframe(perf['account_stats'].set_index('account').style.format(PERFORMANCE_FORMAT),
+                         use_container_width=True)
+    
+    if not overall_holding_df.empty:
+        render_behaviour_patterns(cube, file_digest, overall_holding_df)
+    
+    # Day of week analysis (all indices)
+    st.subheader("📅 Best Days to Trade (All Indices)")
+    
+    dow_all = rollup_pnl(cube, ['trade_weekday', 'trade_day_name'])
+    if 'buy' in dow_all.columns and 'sell' in dow_all.columns:
+        dow_all['dow_pnl'] = net_pnl(dow_all)
+        dow_all = dow_all.sort_index(level='trade_weekday')
+        
+        # Get ordered day names
+        day_names_all = dow_all.index.get_level_values('trade_day_name').unique()
+        
+        fig = px.bar(dow_all.reset_index(), 
+                    x='trade_day_name', 
+                    y='dow_pnl',
+                    title="Overall PnL by Day of Week",
+                    color='dow_pnl',
+                    color_continuous_scale='RdYlGn',
+                    category_orders={"trade_day_name": list(day_names_all)})
+        st.plotly_chart(fig, use_container_width=True)
+        
+        best_day_all = dow_all['dow_pnl'].idxmax()[1]
+        worst_day_all = dow_all['dow_pnl'].idxmin()[1]
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("⭐ Overall Best Day", best_day_all)
+        with col2:
+            st.metric("💔 Overall Worst Day", worst_day_all)
+    
+    # Hourly analysis (all indices)
+    st.subheader("🕒 Best Execution Times (All Indices)")
+    
+    hour_all = rollup_pnl(cube, ['trade_hour'])
+    if 'buy' in hour_all.columns and 'sell' in hour_all.columns:
+        hour_all['hour_pnl'] = net_pnl(hour_all)
+        
+        fig = px.bar(hour_all.reset_index(), 
+                    x='trade_hour', 
+                    y='hour_pnl',
+                    title="Overall PnL by Execution Hour",
+                    color='hour_pnl',
+                    color_continuous_scale='RdYlGn')
+        st.plotly_chart(fig, use_container_width=True)
+        
+        best_hour_all = hour_all['hour_pnl'].idxmax()
+        worst_hour_all = hour_all['hour_pnl'].idxmin()
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("⏰ Overall Best Hour", f"{best_hour_all}:00")
+        with col2:
+            st.metric("👎 Overall Worst Hour", f"{worst_hour_all}:00")
+    
+    # Index comparison
+    st.subheader("📈 Index Performance Comparison")
+    
+    index_comparison = rollup_pnl(cube, ['index_name'])
+    if 'buy' in index_comparison.columns and 'sell' in index_comparison.columns:
+        index_comparison['pnl'] = net_pnl(index_comparison)
+        index_comparison = index_comparison.sort_values('pnl', ascending=False)
+        
+        fig = px.bar(index_comparison.reset_index(), 
+                    x='index_name', 
+                    y='pnl',
+                    title="PnL by Index",
+                    color='pnl',
+                    color_continuous_scale='RdYlGn')
+        st.plotly_chart(fig, use_container_width=True)
+        
+        st.dataframe(index_comparison.style.format("{:.2f}"))
+    
+    # 📥 Export complete analysis (built in the background only when clicked, then cached for this view)
+    st.download_button(
+        label="📥 Download Complete Analysis Report",
+        data=lambda: full_report(file_digest, df, all_holding_df, cube),
+        file_name="complete_pnl_analysis.zip",
+        mime="application/zip",
+        on_click='ignore',
+        help="ZIP of your trades, matched trades with holding times, day/hour/index PnL and summary.json"
+    )
+
+
+POSITION_FORMAT = {'net_quantity': '{:,.0f}', 'cost': '₹{:,.2f}', 'market_value': '₹{:,.2f}',
+                   'unrealized_pnl': '₹{:,.2f}'}
+
+
+@st.fragment
+def render_open_positions(inventory):
+    """
+    📦 Lots the FIFO matcher left open, valued against an uploaded price file.
+
+    Marking is one merge_asof over the prices, so only this fragment reruns
+    when a price file is uploaded or the valuation time changes.
+    """
+    st.header("📦 Open Positions")
+    if inventory.empty:
+        st.success("✅ Every buy has a matching sell: nothing is left open.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("📦 Open Lots", f"{len(inventory):,}")
+    with col2:
+        st.metric("🔤 Symbols", f"{inventory['symbol'].nunique():,}")
+    with col3:
+        st.metric("🗓️ Oldest Lot", f"{inventory['order_execution_time'].min():%d %b %Y}")
+
+    price_file = st.file_uploader("Upload prices (CSV/Parquet: symbol, timestamp, price) to see unrealized PnL",
+                                  type=["csv", "parquet"], key="price_file")
+    if price_file is not None:
+        try:
+            prices = load_prices(upload_digest(price_file), price_file.getvalue(), price_file.name)
+        except ValueError as e:
+            st.error(f"🚨 Can't read {price_file.name}: {e}")
+        else:
+            with recorder.stage("mark_to_market") as stage:
+                inventory = mark_to_market(inventory, prices)
+                stage['rows'] = len(inventory)
+            unpriced = inventory['mark_price'].isna().sum()
+            if unpriced == len(inventory):
+                st.warning(f"💹 {price_file.name} has no usable price for any open symbol, so nothing is marked.")
+            else:
                 col1, col2 = st.columns(2)
                 with col1:
-                    st.metric("⏰ Overall Best Hour", f"{best_hour_all}:00")
+                    st.metric("💹 Market Value", f"₹{inventory['market_value'].sum():,.2f}")
                 with col2:
-                    st.metric("👎 Overall Worst Hour", f"{worst_hour_all}:00")
+                    st.metric("📈 Unrealized PnL", f"₹{inventory['unrealized_pnl'].sum():,.2f}")
+                st.caption(f"Marked at the last price up to {inventory['marked_at'].max():%d %b %Y %H:%M}; "
+                           "expired contracts at the close of their expiry day.")
+            if 0 < unpriced < len(inventory):
+                st.warning(f"💹 {unpriced:,} open lots have no price in {price_file.name} between their entry "
+                           "and then, so they are left out of the market value and unrealized PnL.")
+
+    tabs = st.tabs(["By symbol", "By index", "By expiry"])
+    for tab, keys in zip(tabs, [['index_name', 'symbol', 'side'], ['index_name', 'side'], ['expiry', 'side']]):
+        with tab:
+            st.dataframe(position_table(inventory, keys).style.format(POSITION_FORMAT, na_rep='–'),
+                         use_container_width=True)
+
+
+# 🔴 Live mode
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def render_live(source, fee_schedule):
+    """
+    Poll the live source and redraw its running numbers.
+
+    The LiveTail kept in session state only reads what was appended since the
+    last poll, so every refresh costs O(new fills). Each fee schedule gets its
+    own tail, charging fills as they arrive.
+    """
+    fees_key = charged_digest('', fee_schedule) if fee_schedule is not None else None
+    tail = st.session_state.setdefault('live_tails', {}).setdefault((str(source), fees_key),
+                                                                    LiveTail(source, fee_schedule))
+    try:
+        with recorder.stage("live_poll") as stage:
+            stage['rows'] = tail.poll()
+    except ValueError as e:
+        st.error(f"🚨 Can't read {source.name}: {e}")
+        return
+    
+    st.header(f"🔴 Live: {source.name}")
+    st.caption(f"Updated {tail.polled_at:%H:%M:%S} · refreshes every {LIVE_REFRESH_SECONDS}s")
+    if not tail.fills:
+        st.info("⏳ Waiting for the first fills...")
+        return
+    
+    by_outcome = tail.holding.groupby(level='is_winner').sum()
+    winners = by_outcome.loc[True] if True in by_outcome.index else None
+    losers = by_outcome.loc[False] if False in by_outcome.index else None
+    matched_count = by_outcome['trades'].sum()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("🔄 Fills", f"{tail.fills:,}")
+    with col2:
+        st.metric("🤝 Matched Trades", f"{int(matched_count):,}")
+    with col3:
+        st.metric("💰 Realized PnL", f"₹{by_outcome['pnl'].sum():,.2f}")
+    with col4:
+        win_rate = winners['trades'] / matched_count * 100 if winners is not None and matched_count else 0
+        st.metric("🎯 Win Rate", f"{win_rate:.1f}%")
+    if winners is not None and losers is not None and winners['trades'] and losers['trades']:
+        st.caption(f"⏱️ Avg hold: winners {winners['holding_minutes'] / winners['trades']:.1f} min · "
+                   f"losers {losers['holding_minutes'] / losers['trades']:.1f} min")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        by_day = pnl_table(tail.cube, ['trade_weekday', 'trade_day_name']).reset_index()
+        fig = px.bar(by_day, x='trade_day_name', y='pnl', title="Live PnL by Day of Week",
+                     color='pnl', color_continuous_scale='RdYlGn',
+                     category_orders={"trade_day_name": list(by_day['trade_day_name'])})
+        st.plotly_chart(fig, use_container_width=True)
+    with col2:
+        fig = px.bar(pnl_table(tail.cube, ['trade_hour']).reset_index(), x='trade_hour', y='pnl',
+                     title="Live PnL by Execution Hour", color='pnl', color_continuous_scale='RdYlGn')
+        st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(pnl_table(tail.cube, ['index_name']).style.format('₹{:,.2f}'), use_container_width=True)
+
+
+if live_source is not None:
+    render_live(live_source, fee_schedule)
+
+# 📂 File upload
+st.header("📤 Step 1: Upload Your Trading Data")
+uploaded_files = st.file_uploader("Drag & drop your trading CSV or Excel files here 👇 (several accounts or months at once)",
+                                  type=["csv", "xlsx"], accept_multiple_files=True)
+
+if uploaded_files:
+    try:
+        # 👥 One account per file, named after the file unless renamed here
+        accounts = [Path(uploaded.name).stem for uploaded in uploaded_files]
+        if history_account and len(uploaded_files) == 1:
+            # A lone weekly export belongs to the history's own account, whatever the file is called
+            accounts = [history_name.strip()]
+        if len(uploaded_files) > 1:
+            with st.expander("👥 Which account is each file?"):
+                st.caption("Give monthly exports of the same account the same name to combine them.")
+                named = st.data_editor(pd.DataFrame({'file': [uploaded.name for uploaded in uploaded_files],
+                                                     'account': accounts}),
+                                       disabled=['file'], hide_index=True, use_container_width=True)
+                accounts = [str(name).strip() or default for name, default in zip(named['account'], accounts)]
+        
+        with recorder.stage("parse_enrich") as stage:
+            uploads = [(upload_digest(uploaded), uploaded.getvalue(), uploaded.name, account)
+                       for uploaded, account in zip(uploaded_files, accounts)]
+            file_digest = combined_digest(uploads)
+            df, problems = load_trades(file_digest, uploads)
+            stage['rows'] = len(df) if df is not None else 0
+        if df is not None:
+            loaded_frames['trades'] = df
+            with st.expander("🔍 Peek at your raw data (first 5 rows)"):
+                st.dataframe(df.head())
+        
+        # 🛠 Data processing
+        st.header("🧹 Step 2: Clean & Prepare Data")
+        
+        for file_name, missing_cols in problems.items():
+            st.error(f"🚨 Oops! {file_name} is missing columns: {', '.join(missing_cols)}")
+        if df is not None:
+            if problems:
+                st.warning(f"⚠️ Analyzing the other {len(uploads) - len(problems)} file(s) only.")
             
-            # Index comparison
-            st.subheader("📈 Index Performance Comparison")
+            all_holding_df = None
+            unpriced = 0
+            if history_account:
+                # 📚 Merge into the trade history and analyze all of it (charged as it is stored)
+                fees_key = charged_digest('', fee_schedule) if fee_schedule is not None else None
+                with recorder.stage("history_ingest") as stage:
+                    try:
+                        stats = ingest_history(history_account, file_digest, fees_key, df, fee_schedule)
+                    except ValueError as e:
+                        st.warning(f"📚 Couldn't add this file to your history ({e}), so only this upload is shown.")
+                        history_account = ''
+                    else:
+                        store_digest = TradeStore(Path(HISTORY_DIR) / history_account).digest
+                        df, all_holding_df, open_lots, cube = load_history(history_account, store_digest)
+                        file_digest = f'history-{store_digest}'
+                        unpriced = stats['unpriced']
+                        stage['rows'] = stats['new_fills']
+                        st.success(f"📚 {stats['new_fills']:,} new fills added to '{history_name.strip()}' "
+                                   f"({stats['duplicates']:,} already there) · {len(df):,} fills in your history")
+            if fee_schedule is not None:
+                if not history_account:
+                    # 💸 Cost every fill; matching and the cube then carry net PnL
+                    with recorder.stage("charges") as stage:
+                        file_digest = charged_digest(file_digest, fee_schedule)
+                        df, unpriced = with_charges(file_digest, df, fee_schedule)
+                        stage['rows'] = len(df)
+                if unpriced:
+                    st.warning(f"💸 {unpriced:,} fills have no row in the fee schedule (by exchange, segment & "
+                               "instrument), so they are counted without charges.")
+            if all_holding_df is None:
+                # Matched buy-sell pairs and the aggregation cube for the whole upload (computed once)
+                with recorder.stage("match_trades") as stage:
+                    all_holding_df, open_lots = match_trades(file_digest, df)
+                    stage['rows'] = len(all_holding_df)
+                with recorder.stage("trade_cube") as stage:
+                    cube = trade_cube(file_digest, df)
+                    stage['rows'] = len(cube)
+            inventory = positions_of(file_digest, open_lots, df)
+            loaded_frames.update(matched=all_holding_df, open_lots=inventory, cube=cube)
             
-            index_comparison = df.groupby(['index_name', 'trade_type'])['trade_value'].sum().unstack()
-            if 'buy' in index_comparison.columns and 'sell' in index_comparison.columns:
-                index_comparison['pnl'] = index_comparison['sell'] - index_comparison['buy']
-                index_comparison = index_comparison.sort_values('pnl', ascending=False)
-                
-                fig = px.bar(index_comparison.reset_index(), 
-                            x='index_name', 
-                            y='pnl',
-                            title="PnL by Index",
-                            color='pnl',
-                            color_continuous_scale='RdYlGn')
-                st.plotly_chart(fig, use_container_width=True)
+            # 🗓️ Account, period & index filter, applied once for every section below
+            with recorder.stage("period_filter") as stage:
+                df, all_holding_df, cube, inventory, view_key = filter_view(file_digest, df, all_holding_df,
+                                                                            cube, inventory)
+                stage['rows'] = len(df)
+            
+            if df.empty:
+                st.info("📭 No trades in the selected account, period and indices. Widen the filter in the sidebar.")
+            else:
+                render_index_dashboard(df, view_key, all_holding_df, cube)
                 
-                st.dataframe(index_comparison.style.format("{:.2f}"))
+                # =============================================
+                # 🌍 COMPLETE ANALYSIS SECTION (ALL INDICES)
+                # =============================================
+                with recorder.stage("all_indices_section") as stage:
+                    render_complete_analysis(df, view_key, all_holding_df, cube)
+                    stage['rows'] = len(cube)
             
-            # 📥 Export complete analysis
-            csv_data = index_comparison.to_csv()
-            st.download_button(
-                label="📥 Download Complete Analysis Report",
-                data=csv_data,
-                file_name="complete_pnl_analysis.csv",
-                mime="text/csv"
-            )
+            # 📦 What is still held, valued against an uploaded price file
+            render_open_positions(inventory)
     
     except Exception as e:
         st.error(f"💥 Yikes! Something went wrong: {str(e)}")
@@ -553,6 +1288,25 @@ else:
             """)
         st.session_state.first_visit = False
 
+# 🐞 Stage timings for this rerun
+if debug_mode:
+    with st.expander("🐞 Stage timings (this rerun)", expanded=True):
+        st.caption(f"Run {recorder.run_id}: {recorder.total_seconds():.3f}s in instrumented stages "
+                   "(depth > 0 stages run inside another one). "
+                   + ("" if TRACE_MEMORY else "Set PNL_TRACE_MEMORY=1 on the server for peak memory. ")
+                   + "Every record is also logged as JSON on the 'pnl_funhouse.stages' logger.")
+        st.dataframe(pd.DataFrame(recorder.records, columns=['stage', 'depth', 'seconds', 'rows', 'peak_mb']),
+                     use_container_width=True)
+    
+    if loaded_frames:
+        with st.expander("🧠 Memory footprint (shared by every session with this upload)"):
+            memory = memory_report(loaded_frames)
+            totals = memory.groupby('frame', sort=False)['mb'].sum()
+            st.caption(" · ".join(f"{frame}: {len(loaded_frames[frame]):,} rows, {mb:.1f} MB"
+                                  for frame, mb in totals.items()))
+            st.dataframe(memory.style.format({'mb': '{:.2f}', 'bytes_per_row': '{:.1f}'}),
+                         use_container_width=True)
+
 # 📊 Footer
 st.markdown("""
 ❤️ Pasand aaya? Apne trading friends ko bhi batayein: [Share on WhatsApp](https://wa.me/?text=Check%20this%20cool%20trading%20dashboard%20https://know-your-pnl-behavior-bttqhrtvdzsse3wsp7spuf.streamlit.app/)
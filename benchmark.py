@@ -0,0 +1,170 @@
+"""
+Stage-by-stage benchmark of the analysis pipeline on synthetic tradebooks.
+
+    python benchmark.py --sizes 10000 100000 1000000 --output bench_results.json
+    python benchmark.py --compare bench_results.json   # flag regressions
+
+For every size a tradebook is generated once with tradebook_generator.py
+(cached in --data-dir) and each stage is timed separately: CSV parse, symbol
+decoding, datetime enrichment, fee charges, FIFO holding-time matching and
+the groupby aggregations. The reported time is the best of --repeat runs; peak memory
+comes from one extra run under tracemalloc, which sees NumPy and pandas
+buffers but not pyarrow's own allocator. Results are written as JSON.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from pnl_analysis import (
+    CSV_ENGINE,
+    add_charges,
+    add_contract_columns,
+    add_time_columns,
+    build_trade_cube,
+    calculate_holding_times,
+    read_tradebook,
+    rollup_pnl
+)
+from tradebook_generator import write_tradebook
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]  # add 10000000 explicitly, it takes a while
+
+
+def _aggregate(df):
+    """
+    The cube plus every roll-up the dashboard draws from it
+    """
+    cube = build_trade_cube(df)
+    for keys in (['trade_weekday', 'trade_day_name'], ['trade_hour'], ['index_name']):
+        rollup_pnl(cube, keys)
+    return cube
+
+
+def measure(run, make_input, repeat):
+    """
+    Best wall time of `repeat` runs and peak traced memory of one more run.
+
+    make_input builds a fresh argument outside the timed region, so stages that
+    add columns in place never see their own output.
+    """
+    timings = []
+    for _ in range(repeat):
+        arg = make_input()
+        started = time.perf_counter()
+        result = run(arg)
+        timings.append(time.perf_counter() - started)
+
+    arg = make_input()
+    tracemalloc.start()
+    run(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+
+def benchmark_size(path, rows, repeat):
+    """
+    Time and memory-profile every pipeline stage on one tradebook
+    """
+    parsed = read_tradebook(path)
+    decoded = add_contract_columns(parsed.copy())
+    enriched = add_time_columns(decoded.copy())
+    stages = [
+        ('csv_parse', read_tradebook, lambda: path),
+        ('symbol_decode', add_contract_columns, parsed.copy),
+        ('datetime_enrich', add_time_columns, decoded.copy),
+        ('charges', add_charges, enriched.copy),
+        ('holding_times', calculate_holding_times, lambda: enriched),
+        ('aggregations', _aggregate, lambda: enriched)
+    ]
+
+    results = []
+    for stage, run, make_input in stages:
+        seconds, peak, output = measure(run, make_input, repeat)
+        results.append({
+            'rows': rows,
+            'stage': stage,
+            'seconds': round(seconds, 6),
+            'rows_per_second': round(len(parsed) / seconds) if seconds else None,
+            'peak_mb': round(peak / 2**20, 2),
+            'output_rows': len(output)
+        })
+        print(f"{rows:>10,} {stage:<16} {seconds:9.3f}s {peak / 2**20:10.1f} MB", file=sys.stderr)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Print each stage's time against a previous run; True if any regressed past `threshold`
+    """
+    baseline = {(r['rows'], r['stage']): r for r in json.loads(Path(baseline_path).read_text())['results']}
+    regressed = False
+    for result in results:
+        before = baseline.get((result['rows'], result['stage']))
+        if not before or not before['seconds']:
+            continue
+        ratio = result['seconds'] / before['seconds']
+        flag = '  ⚠️ regression' if ratio > threshold else ''
+        regressed |= ratio > threshold
+        print(f"{result['rows']:>10,} {result['stage']:<16} {ratio:6.2f}x{flag}", file=sys.stderr)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each analysis stage on synthetic tradebooks.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="tradebook sizes in fills")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage (best is kept)")
+    parser.add_argument('--data-dir', type=Path, default=Path('bench_data'), help="cache of generated tradebooks")
+    parser.add_argument('--output', type=Path, help="write the JSON results here (default: stdout)")
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help="compare against an earlier results file")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="slowdown ratio counted as a regression (default: 1.25)")
+    args = parser.parse_args(argv)
+
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    results = []
+    for rows in args.sizes:
+        path = args.data_dir / f'tradebook_{rows}.csv'
+        if not path.exists():
+            print(f"Generating {path} ...", file=sys.stderr)
+            write_tradebook(path, rows)
+        results.extend(benchmark_size(path, rows, args.repeat))
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'csv_engine': CSV_ENGINE,
+        'results': results
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
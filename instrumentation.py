@@ -0,0 +1,69 @@
+"""
+Lightweight per-stage instrumentation for one run of the dashboard script.
+
+Each stage records wall time, an optional row count, its nesting depth and,
+when memory tracing is switched on, peak traced memory. Every record is also
+logged as one JSON line on the "pnl_funhouse.stages" logger.
+"""
+import json
+import logging
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger('pnl_funhouse.stages')
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class StageRecorder:
+    """
+    Collects timing records for the stages of one script run.
+
+    tracemalloc slows pandas down noticeably, and it is process-wide (it
+    slows and counts every thread), so peak memory is only measured when
+    trace_memory is True. Stages may nest: a nested stage gets depth > 0 and
+    no peak of its own, and total_seconds counts only outermost stages.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+        self._depth = 0
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block; set record['rows'] inside it to log a row count
+        """
+        record = {'stage': name, 'seconds': None, 'rows': None, 'peak_mb': None, 'depth': self._depth}
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        self._depth += 1
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self._depth -= 1
+            record['seconds'] = round(time.perf_counter() - started, 6)
+            if record['rows'] is not None:
+                record['rows'] = int(record['rows'])
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                record['peak_mb'] = round(peak / 2**20, 2)
+            self.records.append(record)
+            logger.info(json.dumps({'run_id': self.run_id, **record}))
+
+    def total_seconds(self):
+        """
+        Wall time of the outermost stages (nested ones are already inside them)
+        """
+        return sum(record['seconds'] for record in self.records if record['depth'] == 0)
@@ -0,0 +1,127 @@
+"""
+Batch "Trading Kundali" reports for a directory of tradebooks.
+
+    python kundali_report.py TRADEBOOK_DIR OUTPUT_DIR [--workers N] [--fees [SCHEDULE_CSV]]
+
+Every CSV/Excel tradebook in TRADEBOOK_DIR is analysed in a worker process
+and gets an OUTPUT_DIR/<account>/ folder with summary.json plus the matched
+trades and day/hour/index PnL as CSV. The account name is the file name
+without its extension; OUTPUT_DIR/accounts.csv lists every account's
+headline numbers. With --fees every PnL is net of brokerage and taxes, from
+the given fee schedule CSV or pnl_analysis.DEFAULT_FEE_SCHEDULE.
+
+report_bundle packs the same report, plus the enriched trades, into one ZIP
+in memory; the app serves it as its download.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from pnl_analysis import (
+    DEFAULT_FEE_SCHEDULE,
+    analyze_trades,
+    missing_columns,
+    read_fee_schedule,
+    read_tradebook,
+    report_tables
+)
+from result_cache import FRAME_FORMAT
+
+TRADEBOOK_PATTERNS = ('*.csv', '*.xlsx')
+
+
+def write_report(path, output_dir, fee_schedule=None):
+    """
+    Analyse one tradebook and write its report files (runs in a worker process)
+    """
+    account = path.stem
+    df = read_tradebook(path)
+    missing_cols = missing_columns(df)
+    if missing_cols:
+        raise ValueError(f"missing columns: {', '.join(missing_cols)}")
+
+    result = analyze_trades(df, fee_schedule)
+    cube = result['cube']
+    report_dir = output_dir / account
+    report_dir.mkdir(parents=True, exist_ok=True)
+
+    summary = {'account': account, 'source': str(path), **result['summary']}
+    (report_dir / 'summary.json').write_text(json.dumps(summary, indent=2))
+    result['matched'].to_csv(report_dir / 'matched_trades.csv', index=False)
+    for name, table in report_tables(cube).items():
+        table.to_csv(report_dir / f'{name}.csv')
+    return summary
+
+
+def report_bundle(trades, matched, cube, summary):
+    """
+    ZIP (as bytes) of summary.json, the enriched and matched trades and the day/hour/index PnL tables.
+
+    The trade-level frames are Parquet, which keeps dtypes and is already
+    compressed, or deflated CSV when pyarrow is not installed; the small
+    tables are CSV.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        bundle.writestr('summary.json', json.dumps(summary, indent=2))
+        for name, frame in (('trades', trades), ('matched_trades', matched)):
+            if FRAME_FORMAT == 'parquet':
+                bundle.writestr(f'{name}.parquet', frame.to_parquet(index=False), compress_type=zipfile.ZIP_STORED)
+            else:
+                bundle.writestr(f'{name}.csv', frame.to_csv(index=False))
+        for name, table in report_tables(cube).items():
+            bundle.writestr(f'{name}.csv', table.to_csv())
+    return buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write Trading Kundali reports for a directory of tradebooks.")
+    parser.add_argument('tradebook_dir', type=Path, help="directory of tradebook CSV/Excel files, one per account")
+    parser.add_argument('output_dir', type=Path, help="where the per-account report folders are written")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="worker processes (default: number of CPUs)")
+    parser.add_argument('--fees', nargs='?', const='default', metavar='SCHEDULE_CSV',
+                        help="deduct brokerage and taxes, from this fee schedule (default schedule if no file)")
+    args = parser.parse_args(argv)
+
+    paths = sorted(path for pattern in TRADEBOOK_PATTERNS for path in args.tradebook_dir.glob(pattern))
+    if not paths:
+        parser.error(f"no tradebooks found in {args.tradebook_dir}")
+    fee_schedule = None
+    if args.fees:
+        fee_schedule = DEFAULT_FEE_SCHEDULE if args.fees == 'default' else read_fee_schedule(args.fees)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    started = time.perf_counter()
+    accounts = []
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(write_report, path, args.output_dir, fee_schedule): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"💥 {path.name}: {e}", file=sys.stderr)
+                continue
+            accounts.append({key: value for key, value in summary.items() if not isinstance(value, dict)})
+            print(f"✅ {path.name}")
+
+    if accounts:
+        pd.DataFrame(accounts).sort_values('account').to_csv(args.output_dir / 'accounts.csv', index=False)
+    elapsed = time.perf_counter() - started
+    print(f"{len(accounts)} reports in {elapsed:.1f}s ({len(accounts) / elapsed:.1f}/s), {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Live, incremental analysis of a tradebook that keeps growing during the day.
+
+    python live_tail.py trades_today.csv --interval 5
+    python live_tail.py drop_folder/ --interval 5 --fees
+
+The source is either one CSV in the Sample.csv schema that keeps getting
+rows appended, or a folder where new CSV/Excel tradebooks are dropped (move
+them in complete, don't write them in place). Each poll reads only what was
+added since the last one (by byte offset, or by file name for folders),
+enriches it, continues FIFO matching from the open lots and adds it to the
+cube and the holding-time totals, so a refresh costs O(new rows) instead of
+a recompute of the whole day. With a fee schedule (--fees) the new fills
+are charged as they arrive, so every PnL is net of charges.
+"""
+import argparse
+import io
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from pnl_analysis import (
+    DEFAULT_FEE_SCHEDULE,
+    EMPTY_LOTS,
+    build_trade_cube,
+    concat_frames,
+    enrich_trades,
+    extend_matches,
+    fill_charges,
+    match_fifo,
+    merge_cubes,
+    missing_columns,
+    pnl_table,
+    read_fee_schedule,
+    read_tradebook,
+    tag_index_name
+)
+
+TRADEBOOK_PATTERNS = ('*.csv', '*.xlsx')
+HOLDING_TOTAL_KEYS = ['index_name', 'is_winner']
+
+
+def holding_totals(holding_df):
+    """
+    Matched-trade count, holding minutes and PnL summed per index and outcome
+    """
+    return holding_df.groupby(HOLDING_TOTAL_KEYS, observed=True).agg(
+        trades=('pnl', 'size'),
+        holding_minutes=('holding_minutes', 'sum'),
+        pnl=('pnl', 'sum')
+    )
+
+
+def _add_totals(totals, delta, sign=1):
+    return totals.add(sign * delta, fill_value=0)
+
+
+class LiveTail:
+    """
+    Running analysis of a growing CSV or a drop folder; call poll() to catch up.
+
+    With fee_schedule, PnL is net of charges (see pnl_analysis.add_charges);
+    fills it has no row for are counted in unpriced and charged nothing.
+    """
+
+    def __init__(self, source, fee_schedule=None):
+        self.source = Path(source)
+        self.fee_schedule = fee_schedule
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything read so far (the next poll starts from the beginning)
+        """
+        self.offset = 0
+        self.header = None
+        self.seen_files = set()
+        self.trade_chunks = []
+        self.matched_chunks = []
+        self.open_lots = EMPTY_LOTS.copy()
+        self.last_fill = pd.Series(dtype='datetime64[ns]')  # latest fill time per symbol
+        self.index_of_symbol = pd.DataFrame(columns=['symbol', 'index_name'])
+        self.cube = merge_cubes()
+        self.holding = holding_totals(pd.DataFrame(columns=HOLDING_TOTAL_KEYS + ['holding_minutes', 'pnl']))
+        self.fills = 0
+        self.unpriced = 0
+        self.polled_at = None
+
+    def _read_file_tail(self):
+        """
+        Rows appended to the CSV since the last poll (complete lines only)
+        """
+        size = self.source.stat().st_size
+        if size < self.offset:
+            # Truncated or replaced by a new day's file
+            self.reset()
+        with open(self.source, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return []
+        data = data[:end]
+        self.offset += end
+        if self.header is None:
+            self.header, _, data = data.partition(b'\n')
+            self.header += b'\n'
+        if not data.strip():
+            return []
+        return [read_tradebook(io.BytesIO(self.header + data), self.source.name)]
+
+    def _read_new_files(self):
+        """
+        Tradebooks dropped into the folder since the last poll, oldest first
+        """
+        paths = [path for pattern in TRADEBOOK_PATTERNS for path in self.source.glob(pattern)
+                 if path.name not in self.seen_files]
+        frames = []
+        for path in sorted(paths, key=lambda path: (path.stat().st_mtime, path.name)):
+            frames.append(read_tradebook(path))
+            self.seen_files.add(path.name)
+        return frames
+
+    def poll(self):
+        """
+        Read and analyze whatever arrived since the last poll; returns the number of new fills
+        """
+        frames = self._read_new_files() if self.source.is_dir() else self._read_file_tail()
+        self.polled_at = datetime.now()
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return 0
+        missing_cols = sorted(set().union(*(missing_columns(frame) for frame in frames)))
+        if missing_cols:
+            raise ValueError(f"missing columns: {', '.join(missing_cols)}")
+        new = enrich_trades(concat_frames(frames))
+        if self.fee_schedule is not None:
+            charges = fill_charges(new, self.fee_schedule)
+            self.unpriced += int(charges.isna().sum())
+            new['charges'] = charges.fillna(0)
+        self._add(new)
+        return len(new)
+
+    def _add(self, new):
+        # A symbol whose new fills start before its latest one is re-matched in full
+        first_new = new.groupby('symbol', observed=True)['order_execution_time'].min()
+        first_new.index = first_new.index.astype(object)
+        backfilled = first_new.index[first_new < self.last_fill.reindex(first_new.index)]
+
+        self.trade_chunks.append(new)
+        self.fills += len(new)
+        last_new = new.groupby('symbol', observed=True)['order_execution_time'].max()
+        last_new.index = last_new.index.astype(object)
+        self.last_fill = pd.concat([self.last_fill, last_new]).groupby(level=0).max()
+        self.index_of_symbol = pd.concat([
+            self.index_of_symbol,
+            new[['symbol', 'index_name']].drop_duplicates('symbol').astype(object)
+        ], ignore_index=True).drop_duplicates('symbol')
+
+        matched, self.open_lots = extend_matches(self.open_lots[~self.open_lots['symbol'].isin(backfilled)],
+                                                 new[~new['symbol'].isin(backfilled)])
+        if len(backfilled):
+            history = concat_frames([chunk[chunk['symbol'].isin(backfilled)] for chunk in self.trade_chunks])
+            rematched, reopened = match_fifo(history)
+            for number, chunk in enumerate(self.matched_chunks):
+                dropped = chunk['symbol'].isin(backfilled)
+                if dropped.any():
+                    self.holding = _add_totals(self.holding, holding_totals(chunk[dropped]), sign=-1)
+                    self.matched_chunks[number] = chunk[~dropped]
+            matched = pd.concat([matched, rematched], ignore_index=True)
+            self.open_lots = pd.concat([self.open_lots, reopened], ignore_index=True)
+
+        matched = tag_index_name(matched, self.index_of_symbol)
+        self.matched_chunks.append(matched)
+        self.holding = _add_totals(self.holding, holding_totals(matched))
+        self.cube = merge_cubes(self.cube, build_trade_cube(new))
+
+    @property
+    def trades(self):
+        """
+        Every fill read so far, enriched
+        """
+        return concat_frames(self.trade_chunks) if self.trade_chunks else pd.DataFrame()
+
+    @property
+    def matched(self):
+        """
+        Every matched trade so far, tagged with index_name
+        """
+        return pd.concat(self.matched_chunks, ignore_index=True) if self.matched_chunks else pd.DataFrame()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Follow a growing tradebook and print running PnL.")
+    parser.add_argument('source', type=Path, help="CSV that keeps growing, or a folder of dropped tradebooks")
+    parser.add_argument('--interval', type=float, default=5, help="seconds between polls (default: 5)")
+    parser.add_argument('--fees', nargs='?', const='default', metavar='SCHEDULE_CSV',
+                        help="deduct brokerage and taxes, from this fee schedule (default schedule if no file)")
+    args = parser.parse_args(argv)
+
+    fee_schedule = None
+    if args.fees:
+        fee_schedule = DEFAULT_FEE_SCHEDULE if args.fees == 'default' else read_fee_schedule(args.fees)
+    tail = LiveTail(args.source, fee_schedule)
+    try:
+        while True:
+            new_fills = tail.poll()
+            if new_fills:
+                by_index = pnl_table(tail.cube, ['index_name'])['pnl']
+                totals = tail.holding.sum()
+                print(f"{tail.polled_at:%H:%M:%S} +{new_fills:,} fills ({tail.fills:,} total) · "
+                      f"{int(totals['trades']):,} matched · realized ₹{totals['pnl']:,.2f} · "
+                      + " · ".join(f"{name} ₹{pnl:,.0f}" for name, pnl in by_index.items()), flush=True)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1066 @@
+"""
+UI-free analytics behind the Trading PnL Funhouse dashboard.
+
+Everything here works on plain pandas frames, so the same code drives the
+Streamlit app, the batch report CLI (kundali_report.py) and notebooks.
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+# Bump whenever parsing, enrichment, matching or the cube change their output,
+# so results cached on disk by an older version are not reused
+ANALYSIS_VERSION = '7'
+
+# 📥 Tradebook ingestion: only the columns the analysis reads, with explicit dtypes
+TRADEBOOK_SCHEMA = {
+    'symbol': 'category',
+    'trade_type': 'category',
+    'exchange': 'category',
+    'segment': 'category',
+    'quantity': 'float64',
+    'price': 'float64',  # kept at float64 so rupee PnL sums stay exact to the paisa
+    'trade_id': 'Int64',
+    'order_id': 'Int64',
+    'order_execution_time': 'str',
+    'expiry_date': 'str'
+}
+DATETIME_COLUMNS = ['order_execution_time', 'expiry_date']  # parsed by Arrow, or read as text and parsed after
+ID_COLUMNS = ['trade_id', 'order_id']  # optional; read as inferred, then Int64 unless some id is not a number
+EAGER_READ_LIMIT = 256 * 1024 * 1024  # CSVs bigger than this (bytes) are streamed in chunks
+CSV_CHUNK_ROWS = 1_000_000
+
+try:
+    import pyarrow  # noqa: F401  (optional, multi-threaded CSV parser)
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+
+def _apply_schema(df):
+    """
+    Coerce a freshly read frame (or chunk) to the compact tradebook dtypes
+    """
+    df = df.astype({col: dtype for col, dtype in TRADEBOOK_SCHEMA.items()
+                    if col in df.columns and col not in DATETIME_COLUMNS + ID_COLUMNS})
+    for col in ID_COLUMNS:
+        if col in df.columns:
+            ids = pd.to_numeric(df[col], errors='coerce')
+            # Text ids still identify fills, so they are kept as text rather than lost
+            df[col] = ids.astype('Int64') if ids.notna().sum() == df[col].notna().sum() else df[col].astype('string')
+    if 'order_execution_time' in df.columns:
+        try:
+            times = pd.to_datetime(df['order_execution_time'], format='ISO8601')
+        except (ValueError, TypeError):
+            # Some brokers export e.g. "01-04-2024 10:00:00"; fall back to inferring the format
+            times = pd.to_datetime(df['order_execution_time'])
+        df['order_execution_time'] = times.astype('datetime64[ns]')
+    if 'expiry_date' in df.columns:
+        # A handful of distinct expiries repeated on every fill
+        df['expiry_date'] = (pd.to_datetime(df['expiry_date'], errors='coerce')
+                             .astype('datetime64[ns]').astype('category'))
+    # Lot quantities are whole numbers, so they fit in a small integer type
+    quantity = df.get('quantity')
+    if quantity is not None and quantity.notna().all() and (quantity % 1 == 0).all():
+        df['quantity'] = pd.to_numeric(quantity, downcast='integer')
+    return df
+
+
+def concat_frames(frames):
+    """
+    Concatenate frames, aligning the categories of shared columns so they stay categorical
+    """
+    frames = [frame.copy(deep=False) for frame in frames]
+    for col in frames[0].columns:
+        if all(col in frame.columns and isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames):
+            # Keep the first frame's category order and add new values after it
+            categories = frames[0][col].cat.categories
+            for frame in frames[1:]:
+                categories = categories.append(frame[col].cat.categories.difference(categories))
+            for frame in frames:
+                frame[col] = frame[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_tradebook(source, file_name=''):
+    """
+    Read a broker tradebook (CSV or Excel) from a path or file-like object.
+
+    Only the columns in TRADEBOOK_SCHEMA are parsed, with explicit dtypes
+    instead of inference except for the optional ids (Int64, or text when an
+    export uses non-numeric ids) and timestamps that are not ISO 8601 (their
+    format is inferred, as a plain pd.to_datetime would). CSVs use the pyarrow engine when it is installed,
+    which parses the ISO timestamps itself (forcing them to text would make it
+    round-trip every value through Python strings), and are streamed in
+    CSV_CHUNK_ROWS chunks when larger than EAGER_READ_LIMIT, so peak memory is
+    bounded by one raw chunk plus the compact result.
+    """
+    file_name = str(file_name or source)
+    if file_name.lower().endswith(('.xlsx', '.xls')):
+        return _apply_schema(pd.read_excel(source, usecols=lambda col: col in TRADEBOOK_SCHEMA))
+
+    if hasattr(source, 'seek'):
+        size = source.seek(0, io.SEEK_END)
+        source.seek(0)
+    else:
+        size = os.path.getsize(source)
+    header = pd.read_csv(source, nrows=0).columns
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    usecols = [col for col in header if col in TRADEBOOK_SCHEMA]
+    dtype = {col: TRADEBOOK_SCHEMA[col] for col in usecols if col not in ID_COLUMNS}
+
+    if size > EAGER_READ_LIMIT:
+        reader = pd.read_csv(source, usecols=usecols, dtype=dtype, chunksize=CSV_CHUNK_ROWS)
+        return concat_frames([_apply_schema(chunk) for chunk in reader])
+    if CSV_ENGINE == 'pyarrow':
+        dtype = {col: col_dtype for col, col_dtype in dtype.items() if col not in DATETIME_COLUMNS}
+    return _apply_schema(pd.read_csv(source, usecols=usecols, dtype=dtype, engine=CSV_ENGINE))
+
+
+def merge_tradebooks(frames, accounts):
+    """
+    One frame from several tradebooks, each row tagged with its account.
+
+    `accounts` names the account of each frame; monthly exports of one account
+    share a name, and a fill that appears in two of its exports (same
+    trade_id/order_id) is kept once.
+    """
+    df = concat_frames([frame.assign(account=pd.Categorical([account] * len(frame), categories=[account]))
+                        for frame, account in zip(frames, accounts)])
+    keys = ['account'] + [key for key in ('trade_id', 'order_id') if key in df.columns]
+    if len(keys) > 1:
+        # Fills without an id cannot be told apart, so they are all kept
+        repeated = df.duplicated(keys) & df[keys[1:]].notna().all(axis=1)
+        df = df[~repeated.to_numpy()].reset_index(drop=True)
+    return df
+
+
+# 🧹 Validation & enrichment
+REQUIRED_COLUMNS = ['symbol', 'order_execution_time', 'trade_type', 'quantity', 'price']
+
+
+def missing_columns(df):
+    """
+    Required columns that the tradebook does not have
+    """
+    return [col for col in REQUIRED_COLUMNS if col not in df.columns]
+
+
+# 🔎 Option symbol decoding (e.g. "FINNIFTY2440221300PE", "NIFTY24APR22000CE", "NIFTY24APRFUT")
+WEEKLY_CONTRACT_PATTERN = (r'^(?P<underlying>\D+)(?P<year>\d{2})(?P<month>[1-9OND])(?P<day>\d{2})'
+                           r'(?P<strike>\d+(?:\.\d+)?)(?P<option_type>CE|PE)$')
+MONTHLY_CONTRACT_PATTERN = (r'^(?P<underlying>\D+)(?P<year>\d{2})(?P<month>[A-Z]{3})'
+                            r'(?P<strike>\d+(?:\.\d+)?)?(?P<option_type>CE|PE|FUT)$')
+WEEKLY_MONTH_CODES = {'O': '10', 'N': '11', 'D': '12'}
+
+
+def _broadcast_categorical(values, codes, index):
+    """
+    Expand one value per unique symbol into a row-aligned categorical column
+    """
+    value_codes, categories = pd.factorize(values, sort=True)
+    # Symbol code -1 (missing symbol) picks the trailing -1 and stays missing
+    value_codes = np.append(value_codes, -1)
+    return pd.Series(pd.Categorical.from_codes(value_codes[codes], categories), index=index)
+
+
+def decode_option_symbols(symbols, expiry_dates=None):
+    """
+    Split F&O symbols into categorical underlying, expiry, strike and option_type columns.
+
+    Each unique symbol is parsed once and broadcast back through the category
+    codes, so the cost is O(unique symbols) rather than O(rows). Monthly
+    contracts only encode the month, so their expiry comes from the export's
+    expiry_date column when it is passed in. Symbols that are not F&O
+    contracts keep their leading non-digit part as the underlying.
+    """
+    # Filtered frames keep every category of the original, so drop unused ones first
+    symbol_cat = symbols.astype('category').cat.remove_unused_categories()
+    codes = symbol_cat.cat.codes.to_numpy()
+    unique = pd.Series(symbol_cat.cat.categories.astype(str))
+
+    weekly = unique.str.extract(WEEKLY_CONTRACT_PATTERN)
+    monthly = unique.str.extract(MONTHLY_CONTRACT_PATTERN)
+
+    underlying = (weekly['underlying']
+                  .fillna(monthly['underlying'])
+                  .fillna(unique.str.replace(r'\d.*', '', regex=True)))
+    weekly_month = weekly['month'].replace(WEEKLY_MONTH_CODES)
+    expiry = pd.to_datetime('20' + weekly['year'] + '-' + weekly_month + '-' + weekly['day'],
+                            format='%Y-%m-%d', errors='coerce')
+    if expiry_dates is not None:
+        # The export repeats the contract expiry on every fill of the symbol
+        symbol_expiry = pd.to_datetime(expiry_dates.groupby(codes).first(), errors='coerce')
+        expiry = expiry.fillna(symbol_expiry.reindex(unique.index))
+    strike = pd.to_numeric(weekly['strike'].fillna(monthly['strike']), errors='coerce')
+    option_type = weekly['option_type'].fillna(monthly['option_type'])
+
+    return pd.DataFrame({
+        'underlying': _broadcast_categorical(underlying, codes, symbols.index),
+        'expiry': _broadcast_categorical(expiry, codes, symbols.index),
+        'strike': _broadcast_categorical(strike, codes, symbols.index),
+        'option_type': _broadcast_categorical(option_type, codes, symbols.index)
+    })
+
+
+def add_contract_columns(df):
+    """
+    Add the decoded contract columns and index_name
+    """
+    # Decode the contract once per unique symbol (e.g., "FINNIFTY2440221300PE" → "FINNIFTY")
+    contracts = decode_option_symbols(df['symbol'], df.get('expiry_date'))
+    df[contracts.columns] = contracts
+    df['index_name'] = df['underlying']
+    return df
+
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def add_time_columns(df):
+    """
+    Add trade value and the calendar columns derived from order_execution_time.
+
+    The calendar columns are kept compact: one-byte hour and weekday, the day
+    name as a categorical and the trading day as datetime64 (midnight) rather
+    than Python date objects.
+    """
+    # Convert order_execution_time to datetime
+    df['order_execution_time'] = pd.to_datetime(df['order_execution_time'])
+    
+    # Calculate values
+    df['trade_value'] = df['quantity'] * df['price']
+    df['trade_hour'] = df['order_execution_time'].dt.hour.astype('int8')
+    df['trade_date'] = df['order_execution_time'].dt.normalize()
+    
+    # Create proper day of week columns
+    df['trade_weekday'] = df['order_execution_time'].dt.dayofweek.astype('int8')  # Monday=0, Sunday=6
+    df['trade_day_name'] = pd.Categorical.from_codes(df['trade_weekday'], DAY_NAMES)  # Full day name
+    return df
+
+
+def enrich_trades(df):
+    """
+    Add the index name, trade value and calendar columns used by every section
+    """
+    return add_time_columns(add_contract_columns(df))
+
+
+# 💸 Charges: brokerage and statutory levies of every fill
+FEE_SCHEDULE_KEYS = ['exchange', 'segment', 'instrument']
+FEE_RATE_COLUMNS = ['brokerage_per_order', 'brokerage_pct', 'stt_buy_pct', 'stt_sell_pct', 'exchange_pct',
+                    'sebi_per_crore', 'stamp_buy_pct', 'gst_pct']
+# A discount broker's rates as of late 2024 (*_pct are percent of turnover;
+# brokerage is the flat fee per order, or brokerage_pct of the order value
+# when that is lower). Edit a copy, or load your own with read_fee_schedule.
+DEFAULT_FEE_SCHEDULE = pd.DataFrame([
+    ('NSE', 'FO', 'OPT', 20.0, 0.0, 0.0, 0.1, 0.03503, 10.0, 0.003, 18.0),
+    ('NSE', 'FO', 'FUT', 20.0, 0.03, 0.0, 0.02, 0.00173, 10.0, 0.002, 18.0),
+    ('BSE', 'FO', 'OPT', 20.0, 0.0, 0.0, 0.1, 0.0325, 10.0, 0.003, 18.0),
+    ('BSE', 'FO', 'FUT', 20.0, 0.03, 0.0, 0.02, 0.0, 10.0, 0.002, 18.0),
+    ('NSE', 'EQ', 'EQ', 20.0, 0.03, 0.0, 0.025, 0.00297, 10.0, 0.003, 18.0),
+    ('BSE', 'EQ', 'EQ', 20.0, 0.03, 0.0, 0.025, 0.00375, 10.0, 0.003, 18.0)
+], columns=FEE_SCHEDULE_KEYS + FEE_RATE_COLUMNS)
+INSTRUMENT_OF_OPTION_TYPE = {'CE': 'OPT', 'PE': 'OPT', 'FUT': 'FUT'}  # anything else is EQ
+
+
+def read_fee_schedule(path):
+    """
+    Read a fee schedule CSV with the columns of DEFAULT_FEE_SCHEDULE
+    """
+    schedule = pd.read_csv(path, dtype={key: str for key in FEE_SCHEDULE_KEYS})
+    missing_cols = [col for col in FEE_SCHEDULE_KEYS + FEE_RATE_COLUMNS if col not in schedule.columns]
+    if missing_cols:
+        raise ValueError(f"fee schedule is missing columns: {', '.join(missing_cols)}")
+    return schedule[FEE_SCHEDULE_KEYS + FEE_RATE_COLUMNS]
+
+
+def fill_charges(df, schedule=DEFAULT_FEE_SCHEDULE):
+    """
+    Rupee charges of every enriched fill: brokerage, STT, exchange and SEBI fees, stamp duty and GST.
+
+    Each fill's instrument (OPT, FUT or EQ) comes from its decoded
+    option_type, and its rates from the schedule row of its exchange, segment
+    and instrument, found with one index lookup for the whole frame. The
+    per-order brokerage is spread over the order's fills (within its account)
+    by value. Fills with no schedule row (or no exchange/segment) cost NaN.
+    Blank rates count as 0, and the last of repeated schedule rows wins.
+    """
+    schedule = schedule.drop_duplicates(FEE_SCHEDULE_KEYS, keep='last')
+    # One lookup per option_type category; code -1 (no option type, e.g. an equity symbol) picks the trailing EQ
+    option_type = df['option_type'].astype('category')
+    instrument = np.append([INSTRUMENT_OF_OPTION_TYPE.get(value, 'EQ') for value in option_type.cat.categories],
+                           'EQ').astype(object)[option_type.cat.codes.to_numpy()]
+    rows = pd.MultiIndex.from_arrays([df.get('exchange', pd.Series(np.nan, index=df.index)),
+                                      df.get('segment', pd.Series(np.nan, index=df.index)), instrument])
+    position = pd.MultiIndex.from_frame(schedule[FEE_SCHEDULE_KEYS]).get_indexer(rows)
+    # Index -1 (no schedule row) picks the trailing row of NaN rates
+    rates = np.vstack([schedule[FEE_RATE_COLUMNS].fillna(0).to_numpy(dtype='float64'),
+                       np.full(len(FEE_RATE_COLUMNS), np.nan)])[position]
+    rate = dict(zip(FEE_RATE_COLUMNS, rates.T))
+
+    value = df['trade_value'].to_numpy(dtype='float64')
+    is_buy = (df['trade_type'] == 'buy').to_numpy()
+    order_value = value
+    if 'order_id' in df.columns:
+        orders = [df[key] for key in position_keys(df)[:-1] + ['order_id']]
+        order_value = df['trade_value'].groupby(orders, observed=True).transform('sum').fillna(df['trade_value'])
+        order_value = order_value.to_numpy(dtype='float64')
+    per_order = np.where(rate['brokerage_pct'] > 0,
+                         np.minimum(rate['brokerage_per_order'], order_value * rate['brokerage_pct'] / 100),
+                         rate['brokerage_per_order'])
+    brokerage = per_order * np.divide(value, order_value, out=np.ones_like(value), where=order_value != 0)
+    stt = value * np.where(is_buy, rate['stt_buy_pct'], rate['stt_sell_pct']) / 100
+    exchange = value * rate['exchange_pct'] / 100
+    sebi = value * rate['sebi_per_crore'] / 1e7
+    stamp = np.where(is_buy, value * rate['stamp_buy_pct'] / 100, 0.0)
+    gst = (brokerage + exchange + sebi) * rate['gst_pct'] / 100
+    return pd.Series(brokerage + stt + exchange + sebi + stamp + gst, index=df.index, name='charges')
+
+
+def add_charges(df, schedule=DEFAULT_FEE_SCHEDULE):
+    """
+    Add the charges column (0 for fills the schedule does not cover), so matching and the cube net it out
+    """
+    df['charges'] = fill_charges(df, schedule).fillna(0)
+    return df
+
+
+# ⏱️ FIFO matching of buys and sells into round trips
+HOLDING_COLUMNS = ['symbol', 'buy_time', 'sell_time', 'quantity', 'holding_minutes', 'pnl', 'is_winner']
+LOT_COLUMNS = ['symbol', 'order_execution_time', 'trade_type', 'quantity', 'price']
+EMPTY_MATCHES = pd.DataFrame({
+    'symbol': pd.Series(dtype=object), 'buy_time': pd.Series(dtype='datetime64[ns]'),
+    'sell_time': pd.Series(dtype='datetime64[ns]'), 'quantity': pd.Series(dtype='float64'),
+    'holding_minutes': pd.Series(dtype='float64'),
+    'pnl': pd.Series(dtype='float64'), 'is_winner': pd.Series(dtype=bool)
+})
+EMPTY_LOTS = pd.DataFrame({
+    'symbol': pd.Series(dtype=object), 'order_execution_time': pd.Series(dtype='datetime64[ns]'),
+    'trade_type': pd.Series(dtype=object), 'quantity': pd.Series(dtype='float64'),
+    'price': pd.Series(dtype='float64')
+})
+
+
+def position_keys(df):
+    """
+    Columns that identify a position: the symbol, within its account when there is one
+    """
+    return ['account', 'symbol'] if 'account' in df.columns else ['symbol']
+
+
+def _empty_like(empty, keys, extra=()):
+    """
+    An empty matches or lots frame with the position key columns first and `extra` float columns last
+    """
+    columns = keys + list(empty.columns[1:]) + list(extra)
+    return empty.assign(**{key: pd.Series(dtype=object) for key in keys},
+                        **{col: pd.Series(dtype='float64') for col in extra})[columns]
+
+
+def _group_cumsum(values, starts):
+    """
+    Cumulative sum that restarts at every group start (rows must be grouped)
+    """
+    totals = np.cumsum(values)
+    group_ids = np.cumsum(starts) - 1
+    before_group = np.concatenate(([0.0], totals))[np.flatnonzero(starts)]
+    return totals - before_group[group_ids]
+
+
+def match_fifo(trade_df):
+    """
+    FIFO-match buys and sells; returns (matched pieces, open lots).
+
+    Every unit bought is paired with the unit sold at the same offset in the
+    position's cumulative quantity, which is exactly FIFO: partial fills split a
+    lot and the leftover quantity carries forward to the next match. Sells that
+    come before the buys they close (short trades) are matched the same way.
+
+    A position is one symbol, or one (account, symbol) pair when the trades
+    have an account column (see position_keys), so accounts never net against
+    each other. The open lots are the unmatched remainder of each position's
+    longer side, as fills in time order. Feeding them back in ahead of later
+    fills continues the matching exactly where it stopped (see extend_matches).
+
+    When the trades have a charges column (see add_charges), each fill's
+    charges are split over its units: every matched piece gets the charges of
+    the units it closes, its pnl is net of them (gross_pnl is before) and
+    is_winner is decided on the net pnl. Open lots keep the charges of their
+    open units.
+    """
+    keys = position_keys(trade_df)
+    charged = ['charges'] if 'charges' in trade_df.columns else []
+    trades = trade_df[keys[:-1] + LOT_COLUMNS + charged]
+    trades = trades[trades['trade_type'].isin(['buy', 'sell'])]
+    if trades.empty:
+        return (_empty_like(EMPTY_MATCHES, keys, charged and ['charges', 'gross_pnl']),
+                _empty_like(EMPTY_LOTS, keys, charged))
+
+    # Sort by position and time (stable, so same-timestamp fills keep file order)
+    trades = trades.sort_values(keys + ['order_execution_time'], kind='mergesort')
+    position_start = np.zeros(len(trades), dtype=bool)
+    position_start[0] = True
+    for key in keys:
+        key_codes = pd.factorize(trades[key])[0]
+        position_start[1:] |= key_codes[1:] != key_codes[:-1]
+    position_codes = np.cumsum(position_start) - 1
+    first_rows = np.flatnonzero(position_start)
+    positions = {key: trades[key].iloc[first_rows].to_numpy() for key in keys}
+    is_buy = (trades['trade_type'] == 'buy').to_numpy()
+    quantity = trades['quantity'].to_numpy(dtype='float64')
+    price = trades['price'].to_numpy(dtype='float64')
+    times = trades['order_execution_time'].to_numpy(dtype='datetime64[ns]')
+    unit_charges = np.zeros_like(quantity)
+    if charged:
+        np.divide(trades['charges'].to_numpy(dtype='float64'), quantity, out=unit_charges, where=quantity != 0)
+
+    # Split into buy and sell lot streams, each still grouped by position
+    sides = {}
+    for side, mask in (('buy', is_buy), ('sell', ~is_buy)):
+        codes = position_codes[mask]
+        qty = quantity[mask]
+        starts = np.ones(len(codes), dtype=bool)
+        starts[1:] = codes[1:] != codes[:-1]
+        cum_end = _group_cumsum(qty, starts) if len(codes) else qty
+        totals = np.bincount(codes, weights=qty, minlength=position_codes[-1] + 1)
+        sides[side] = (codes, cum_end, totals, price[mask], times[mask], unit_charges[mask])
+
+    # Only the quantity present on both sides can be matched; lay every
+    # position's matchable quantity end to end on one global axis
+    matched_total = np.minimum(sides['buy'][2], sides['sell'][2])
+    offsets = np.concatenate(([0.0], np.cumsum(matched_total)[:-1]))
+
+    lot_ends = {}
+    open_lots = []
+    for side, (codes, cum_end, _, side_price, side_time, side_charges) in sides.items():
+        lot_ends[side] = offsets[codes] + np.minimum(cum_end, matched_total[codes])
+        # Whatever lies past the matched total stays open
+        open_qty = np.minimum(quantity[is_buy if side == 'buy' else ~is_buy],
+                              np.maximum(cum_end - matched_total[codes], 0))
+        is_open = open_qty > 0
+        open_lots.append(pd.DataFrame({
+            **{key: values[codes[is_open]] for key, values in positions.items()},
+            'order_execution_time': side_time[is_open],
+            'trade_type': side,
+            'quantity': open_qty[is_open],
+            'price': side_price[is_open],
+            **({'charges': side_charges[is_open] * open_qty[is_open]} if charged else {})
+        }))
+    open_lots = (pd.concat(open_lots, ignore_index=True)
+                 .sort_values(keys + ['order_execution_time'], kind='mergesort', ignore_index=True))
+
+    # Every lot boundary on either side cuts the axis into matched pieces
+    edges = np.union1d(lot_ends['buy'], lot_ends['sell'])
+    piece_start = np.concatenate(([0.0], edges[:-1]))
+    piece_qty = edges - piece_start
+    keep = piece_qty > 0
+    piece_start, piece_qty = piece_start[keep], piece_qty[keep]
+    if len(piece_qty) == 0:
+        return _empty_like(EMPTY_MATCHES, keys, charged and ['charges', 'gross_pnl']), open_lots
+
+    buy_idx = np.searchsorted(lot_ends['buy'], piece_start, side='right')
+    sell_idx = np.searchsorted(lot_ends['sell'], piece_start, side='right')
+
+    buy_codes, _, _, buy_price, buy_time, buy_charges = sides['buy']
+    _, _, _, sell_price, sell_time, sell_charges = sides['sell']
+    buy_time = buy_time[buy_idx]
+    sell_time = sell_time[sell_idx]
+
+    # Calculate holding time in minutes and PnL for each matched piece
+    holding_mins = np.abs(sell_time - buy_time) / np.timedelta64(1, 'm')
+    gross_pnl = (sell_price[sell_idx] - buy_price[buy_idx]) * piece_qty
+    charges = (buy_charges[buy_idx] + sell_charges[sell_idx]) * piece_qty
+    pnl = gross_pnl - charges
+
+    matched = pd.DataFrame({
+        **{key: values[buy_codes[buy_idx]] for key, values in positions.items()},
+        'buy_time': buy_time,
+        'sell_time': sell_time,
+        'quantity': piece_qty,
+        'holding_minutes': holding_mins,
+        'pnl': pnl,
+        'is_winner': pnl > 0,
+        **({'charges': charges, 'gross_pnl': gross_pnl} if charged else {})
+    })
+    return matched, open_lots
+
+
+def calculate_holding_times(trade_df):
+    """
+    Calculate holding times for completed trades with FIFO lot accounting
+    """
+    return match_fifo(trade_df)[0]
+
+
+def extend_matches(open_lots, new_trades):
+    """
+    Continue FIFO matching with fills that come after the ones already matched.
+
+    open_lots is the second value of an earlier match_fifo call. Every new fill
+    of a symbol must be no earlier than that symbol's last matched fill;
+    otherwise the symbol has to be re-matched from its full history. Returns
+    the newly matched pieces and the updated open lots.
+    """
+    columns = position_keys(new_trades)[:-1] + LOT_COLUMNS + (['charges'] if 'charges' in new_trades.columns else [])
+    # Open lots go first so equal timestamps keep their original order
+    return match_fifo(concat_frames([open_lots.reindex(columns=columns), new_trades[columns]]))
+
+
+def tag_index_name(holding_df, df):
+    """
+    Add the index_name of each matched trade's symbol, looked up from the trades
+    """
+    index_of_symbol = df.drop_duplicates('symbol').set_index('symbol')['index_name']
+    holding_df['index_name'] = holding_df['symbol'].map(index_of_symbol)
+    return holding_df
+
+
+# 📦 Open positions: lots the matcher left open, optionally marked to market
+PRICE_COLUMNS = ['symbol', 'timestamp', 'price']
+PRICE_COLUMN_ALIASES = {'date': 'timestamp', 'time': 'timestamp', 'datetime': 'timestamp',
+                        'close': 'price', 'ltp': 'price', 'last_price': 'price'}
+MARKET_CLOSE = pd.Timedelta(hours=15, minutes=30)  # expiring contracts settle at the day's close
+
+
+def read_prices(source, file_name=''):
+    """
+    Read a price file (CSV or Parquet) of symbol, timestamp and price rows, sorted by timestamp.
+
+    Daily closes and intraday prices both work; date/time/close/ltp are
+    accepted as column names too. Symbols are categorical, so millions of rows
+    stay compact, and timestamps with a timezone are converted to naive IST
+    like the tradebook's.
+    """
+    file_name = str(file_name or source)
+    if file_name.lower().endswith('.parquet'):
+        prices = pd.read_parquet(source)
+    else:
+        prices = pd.read_csv(source, engine=CSV_ENGINE)
+    prices.columns = [str(col).strip().lower() for col in prices.columns]
+    prices = prices.rename(columns={alias: name for alias, name in PRICE_COLUMN_ALIASES.items()
+                                    if name not in prices.columns})
+    missing_cols = [col for col in PRICE_COLUMNS if col not in prices.columns]
+    if missing_cols:
+        raise ValueError(f"price file is missing columns: {', '.join(missing_cols)}")
+    prices = prices[PRICE_COLUMNS].astype({'symbol': 'category', 'price': 'float64'})
+    timestamp = pd.to_datetime(prices['timestamp'])
+    if timestamp.dt.tz is not None:
+        timestamp = timestamp.dt.tz_convert('Asia/Kolkata').dt.tz_localize(None)
+    prices['timestamp'] = timestamp.astype('datetime64[ns]')
+    return prices.sort_values('timestamp', kind='mergesort', ignore_index=True)
+
+
+def open_inventory(open_lots, df):
+    """
+    Open lots (from match_fifo) with their side and the index_name and expiry of their symbol.
+
+    A lot left over from buys is long and one left over from sells is short.
+    """
+    contracts = df.drop_duplicates('symbol').set_index('symbol')
+    inventory = open_lots.copy()
+    inventory['side'] = np.where(inventory['trade_type'] == 'buy', 'long', 'short')
+    inventory['index_name'] = inventory['symbol'].map(contracts['index_name'])
+    inventory['expiry'] = pd.to_datetime(inventory['symbol'].map(contracts['expiry']).astype(object))
+    return inventory
+
+
+def mark_to_market(inventory, prices, as_of=None):
+    """
+    Value open lots at their symbol's last price at or before `as_of` (default: the last price time in `prices`).
+
+    A contract that expired before `as_of` is marked at its last price up to
+    the close of its expiry day instead. One merge_asof by symbol over the
+    time-sorted prices (only rows of symbols with an open lot) does it for
+    every lot at once. Adds mark_price and marked_at, market_value (negative
+    for shorts) and unrealized_pnl, net of any entry charges the lot carries;
+    lots with no price by then, or only prices from before the lot was
+    opened, get NaN.
+    """
+    prices = prices[prices['symbol'].isin(inventory['symbol'].unique())]
+    if prices.empty:
+        # No price for any open symbol: every lot stays unpriced
+        return (inventory.assign(mark_price=np.nan, marked_at=pd.NaT, market_value=np.nan, unrealized_pnl=np.nan)
+                .astype({'marked_at': 'datetime64[ns]'}))
+    if not prices['timestamp'].is_monotonic_increasing:
+        prices = prices.sort_values('timestamp', kind='mergesort')
+    as_of = prices['timestamp'].max() if as_of is None else pd.Timestamp(as_of)
+    expiry_close = inventory['expiry'] + MARKET_CLOSE
+    mark_time = expiry_close.where(expiry_close < as_of, as_of)
+
+    # Matching symbols on one categorical dtype keeps the join on integer codes
+    symbol_dtype = pd.CategoricalDtype(inventory['symbol'].astype(object).unique())
+    lots = (inventory.assign(mark_time=mark_time.astype('datetime64[ns]'), lot=np.arange(len(inventory)),
+                             symbol_code=inventory['symbol'].astype(symbol_dtype))
+            .sort_values('mark_time', kind='mergesort'))
+    marks = prices.rename(columns={'symbol': 'symbol_code', 'timestamp': 'marked_at', 'price': 'mark_price'})
+    marks = marks.astype({'symbol_code': symbol_dtype, 'marked_at': 'datetime64[ns]'})
+    marked = (pd.merge_asof(lots, marks, left_on='mark_time', right_on='marked_at', by='symbol_code',
+                            direction='backward')
+              .sort_values('lot', ignore_index=True)
+              .drop(columns=['mark_time', 'lot', 'symbol_code']))
+    # A price from before the lot was opened says nothing about it
+    stale = (marked['marked_at'] < marked['order_execution_time']).to_numpy()
+    marked['mark_price'] = marked['mark_price'].mask(stale)
+    marked['marked_at'] = marked['marked_at'].mask(stale)
+
+    sign = np.where(marked['trade_type'] == 'buy', 1.0, -1.0)
+    marked['market_value'] = sign * marked['quantity'] * marked['mark_price']
+    marked['unrealized_pnl'] = sign * (marked['mark_price'] - marked['price']) * marked['quantity']
+    if 'charges' in marked.columns:
+        marked['unrealized_pnl'] -= marked['charges']
+    return marked
+
+
+def position_table(inventory, keys):
+    """
+    Open lots, net quantity (long minus short) and cost rolled up to `keys`.
+
+    For marked lots also market value and unrealized PnL (NaN when no lot in
+    the group has a price) and how many lots were priced.
+    """
+    sign = np.where(inventory['trade_type'] == 'buy', 1.0, -1.0)
+    grouped = (inventory.assign(net_quantity=sign * inventory['quantity'],
+                                cost=sign * inventory['quantity'] * inventory['price'])
+               .groupby(keys, observed=True, dropna=False, sort=True))
+    table = grouped[['net_quantity', 'cost']].sum()
+    table.insert(0, 'lots', grouped.size())
+    if 'mark_price' in inventory.columns:
+        table[['market_value', 'unrealized_pnl']] = grouped[['market_value', 'unrealized_pnl']].sum(min_count=1)
+        table['priced_lots'] = grouped['mark_price'].count()
+    return table
+
+
+# 🧊 Aggregation cube: every day/hour/index chart is a roll-up of this
+# trade_date leads, so the cube is sorted by day and can be sliced to a date range
+CUBE_KEYS = ['trade_date', 'index_name', 'trade_weekday', 'trade_day_name', 'trade_hour', 'trade_type']
+
+
+def cube_keys(df):
+    """
+    CUBE_KEYS, with account after trade_date when the trades (or cube) have one
+    """
+    return CUBE_KEYS[:1] + ['account'] + CUBE_KEYS[1:] if 'account' in df.columns else CUBE_KEYS
+
+
+def build_trade_cube(df):
+    """
+    Sum value, quantity, price (and charges) and count fills per (day, account, index, hour, side) in one pass
+    """
+    charges = {'charges': ('charges', 'sum')} if 'charges' in df.columns else {}
+    return df.groupby(cube_keys(df), observed=True, sort=True).agg(
+        trade_value=('trade_value', 'sum'),
+        quantity=('quantity', 'sum'),
+        price_sum=('price', 'sum'),
+        trade_count=('price', 'size'),
+        **charges
+    ).reset_index()
+
+
+def merge_cubes(*cubes):
+    """
+    One cube from cubes of disjoint sets of fills (every measure is a sum)
+    """
+    cubes = [cube for cube in cubes if len(cube)]
+    if not cubes:
+        return pd.DataFrame(columns=CUBE_KEYS + ['trade_value', 'quantity', 'price_sum', 'trade_count'])
+    return concat_frames(cubes).groupby(cube_keys(cubes[0]), observed=True, sort=True).sum().reset_index()
+
+
+def rollup_pnl(cube, keys):
+    """
+    Roll the cube up to `keys` with buy and sell value (and charges, when the cube has them) as columns
+    """
+    table = cube.groupby(keys + ['trade_type'], observed=True, sort=True)['trade_value'].sum().unstack()
+    if 'charges' in cube.columns:
+        table['charges'] = cube.groupby(keys, observed=True, sort=True)['charges'].sum()
+    return table
+
+
+def net_pnl(table):
+    """
+    Sell value minus buy value, less charges when the rolled-up table has them
+    """
+    pnl = table['sell'] - table['buy']
+    return pnl - table['charges'] if 'charges' in table.columns else pnl
+
+
+def side_summary(cube):
+    """
+    Quantity, average price, value, fill count (and charges) per trade_type
+    """
+    charges = {'charges': ('charges', 'sum')} if 'charges' in cube.columns else {}
+    summary = cube.groupby('trade_type', observed=True).agg(
+        total_quantity=('quantity', 'sum'),
+        price_sum=('price_sum', 'sum'),
+        total_value=('trade_value', 'sum'),
+        trade_count=('trade_count', 'sum'),
+        **charges
+    ).reset_index()
+    summary['avg_price'] = summary['price_sum'] / summary['trade_count']
+    return summary[['trade_type', 'total_quantity', 'avg_price', 'total_value', 'trade_count', *charges]]
+
+
+def pnl_table(cube, keys):
+    """
+    Buy value, sell value and their difference (pnl) rolled up to `keys`.
+
+    When the cube has charges, they get a column too, gross_pnl is the plain
+    difference and pnl is net of charges.
+    """
+    columns = ['buy', 'sell'] + (['charges'] if 'charges' in cube.columns else [])
+    table = rollup_pnl(cube, keys).reindex(columns=columns, fill_value=0).fillna(0)
+    table.columns = columns
+    if 'charges' in table.columns:
+        table['gross_pnl'] = table['sell'] - table['buy']
+    table['pnl'] = net_pnl(table)
+    return table
+
+
+# 📈 Equity curve, drawdown and streaks of realized PnL
+def exit_times(holding_df):
+    """
+    When each matched trade was closed: the later of its buy and sell (shorts close on the buy)
+    """
+    return np.maximum(holding_df['buy_time'].to_numpy(), holding_df['sell_time'].to_numpy())
+
+
+def equity_curve(holding_df, keys=()):
+    """
+    Realized PnL over time, per `keys` (e.g. ['index_name']) or overall.
+
+    Matched trades are ordered by exit time (the later of buy and sell, so
+    shorts count when they are bought back). equity is the running sum of pnl,
+    peak its running maximum (starting from zero) and drawdown the distance
+    below that peak.
+    """
+    keys = list(keys)
+    curve = (holding_df[keys + ['pnl', 'is_winner']]
+             .assign(exit_time=exit_times(holding_df))
+             .sort_values(keys + ['exit_time'], kind='mergesort', ignore_index=True))
+    pnl = curve['pnl'].astype('float64')
+    if keys:
+        curve['equity'] = pnl.groupby([curve[key] for key in keys], observed=True).cumsum()
+        peak = curve['equity'].groupby([curve[key] for key in keys], observed=True).cummax()
+    else:
+        curve['equity'] = pnl.cumsum()
+        peak = curve['equity'].cummax()
+    curve['peak'] = peak.clip(lower=0)
+    curve['drawdown'] = curve['equity'] - curve['peak']
+    return curve
+
+
+def performance_stats(holding_df, keys=()):
+    """
+    Expectancy, max drawdown and longest winning/losing streaks per `keys` or overall.
+
+    One pass over the exit-ordered curve: streaks come from run-length
+    encoding is_winner within each group.
+    """
+    keys = list(keys)
+    curve = equity_curve(holding_df, keys)
+    if curve.empty:
+        return pd.DataFrame(columns=keys + ['trades', 'win_rate_pct', 'net_pnl', 'expectancy', 'avg_win',
+                                            'avg_loss', 'max_drawdown', 'longest_win_streak', 'longest_loss_streak'])
+    # The curve is sorted by keys, so every group is one contiguous block
+    group = curve.groupby(keys, observed=True, sort=False).ngroup().to_numpy() if keys else np.zeros(len(curve), int)
+    group_start = np.ones(len(curve), dtype=bool)
+    group_start[1:] = group[1:] != group[:-1]
+    is_winner = curve['is_winner'].to_numpy(dtype=bool)
+
+    # A new run starts at every group start and every change of outcome
+    run_start = group_start.copy()
+    run_start[1:] |= is_winner[1:] != is_winner[:-1]
+    runs = pd.DataFrame({
+        'group': group[run_start],
+        'is_winner': is_winner[run_start],
+        'length': np.diff(np.append(np.flatnonzero(run_start), len(curve)))
+    })
+    streaks = runs.groupby(['group', 'is_winner'])['length'].max().unstack(fill_value=0)
+
+    pnl = curve['pnl'].astype('float64')
+    stats = pd.DataFrame({
+        'trades': pnl.groupby(group).size(),
+        'win_rate_pct': pd.Series(is_winner).groupby(group).mean() * 100,
+        'net_pnl': pnl.groupby(group).sum(),
+        'expectancy': pnl.groupby(group).mean(),
+        'avg_win': pnl[is_winner].groupby(group[is_winner]).mean(),
+        'avg_loss': pnl[~is_winner].groupby(group[~is_winner]).mean(),
+        'max_drawdown': curve['drawdown'].groupby(group).min(),
+        'longest_win_streak': streaks.get(True, 0),
+        'longest_loss_streak': streaks.get(False, 0)
+    })
+    stats[['longest_win_streak', 'longest_loss_streak']] = (stats[['longest_win_streak', 'longest_loss_streak']]
+                                                            .fillna(0).astype(int))
+    if keys:
+        stats = curve.loc[group_start, keys].set_index(group[group_start]).join(stats)
+    return stats.reset_index(drop=True)
+
+
+# 🧠 Behaviour patterns that cost money
+def round_trips(holding_df):
+    """
+    Matched pieces collapsed into one round trip per entry fill, ordered by entry.
+
+    entry_time is the opening fill (the sell for shorts) and exit_time the last
+    fill that closed it; quantity and pnl are summed over the pieces.
+    """
+    entry_time = np.minimum(holding_df['buy_time'].to_numpy(), holding_df['sell_time'].to_numpy())
+    keys = position_keys(holding_df)[:-1] + ['index_name', 'symbol', 'entry_time']
+    trips = (holding_df.assign(entry_time=entry_time, exit_time=exit_times(holding_df))
+             .groupby(keys, observed=True, sort=False)
+             .agg(exit_time=('exit_time', 'max'), quantity=('quantity', 'sum'), pnl=('pnl', 'sum'))
+             .reset_index()
+             .sort_values('entry_time', kind='mergesort', ignore_index=True))
+    trips['is_winner'] = trips['pnl'] > 0
+    return trips
+
+
+def flag_revenge_trades(trips, window_minutes=15):
+    """
+    Mark round trips entered within `window_minutes` after closing a losing one.
+
+    merge_asof finds, for every entry, the latest loss that exited strictly
+    before it (on any index); is_revenge is set when that loss is recent enough.
+    """
+    losses = (trips.loc[~trips['is_winner'], ['exit_time', 'pnl']]
+              .rename(columns={'exit_time': 'loss_exit_time', 'pnl': 'loss_pnl'})
+              .sort_values('loss_exit_time', kind='mergesort'))
+    flagged = pd.merge_asof(trips, losses, left_on='entry_time', right_on='loss_exit_time', direction='backward',
+                            tolerance=pd.Timedelta(minutes=window_minutes), allow_exact_matches=False)
+    flagged['is_revenge'] = flagged['loss_exit_time'].notna()
+    return flagged
+
+
+def flag_size_escalation(trips, factor=1.0):
+    """
+    Mark round trips sized above `factor` times the previous closed trade on the same index after a loss.
+
+    "Previous" is the last round trip of that index (in the same account) that
+    had exited before this one was entered, so overlapping positions are not
+    compared.
+    """
+    by = position_keys(trips)[:-1] + ['index_name']
+    previous = (trips[by + ['exit_time', 'quantity', 'pnl']]
+                .rename(columns={'exit_time': 'prev_exit_time', 'quantity': 'prev_quantity', 'pnl': 'prev_pnl'})
+                .sort_values('prev_exit_time', kind='mergesort'))
+    flagged = pd.merge_asof(trips, previous, left_on='entry_time', right_on='prev_exit_time', by=by,
+                            direction='backward', allow_exact_matches=False)
+    flagged['is_escalation'] = (flagged['prev_pnl'] <= 0) & (flagged['quantity'] > factor * flagged['prev_quantity'])
+    return flagged
+
+
+def flag_overtrading_days(cube, holding_df, window=20, threshold=2.0):
+    """
+    Fills and realized PnL per trading day, with days above `threshold` times the rolling baseline flagged.
+
+    The baseline is the median fill count of the previous `window` trading
+    days (at least 5), so a spike never raises its own baseline.
+    """
+    days = cube.groupby('trade_date')['trade_count'].sum().rename('fills').to_frame()
+    days['baseline'] = days['fills'].rolling(window, min_periods=5).median().shift(1)
+    days['is_spike'] = days['fills'] > threshold * days['baseline']
+    exit_day = pd.Series(exit_times(holding_df)).dt.normalize()
+    realized = holding_df['pnl'].groupby(exit_day.to_numpy()).sum()
+    days['pnl'] = realized.reindex(days.index, fill_value=0)
+    return days.reset_index()
+
+
+def behaviour_summary(holding_df, cube, revenge_minutes=15, spike_threshold=2.0):
+    """
+    Counts and PnL of revenge trades, size escalations and overtrading days
+    """
+    trips = round_trips(holding_df)
+    revenge = flag_revenge_trades(trips, revenge_minutes)['is_revenge'].to_numpy()
+    escalation = flag_size_escalation(trips)['is_escalation'].to_numpy()
+    days = flag_overtrading_days(cube, holding_df, threshold=spike_threshold)
+    return {
+        'round_trips': len(trips),
+        'revenge_trades': int(revenge.sum()),
+        'revenge_pnl': _json_number(trips.loc[revenge, 'pnl'].sum()),
+        'revenge_win_rate_pct': _json_number(trips.loc[revenge, 'is_winner'].mean() * 100) if revenge.any() else None,
+        'other_win_rate_pct': _json_number(trips.loc[~revenge, 'is_winner'].mean() * 100) if (~revenge).any() else None,
+        'size_escalations': int(escalation.sum()),
+        'escalation_pnl': _json_number(trips.loc[escalation, 'pnl'].sum()),
+        'overtrading_days': int(days['is_spike'].sum()),
+        'overtrading_pnl': _json_number(days.loc[days['is_spike'], 'pnl'].sum()),
+        'avg_pnl_overtrading_day': _json_number(days.loc[days['is_spike'], 'pnl'].mean()) if days['is_spike'].any() else None,
+        'avg_pnl_other_day': _json_number(days.loc[~days['is_spike'], 'pnl'].mean()) if (~days['is_spike']).any() else None
+    }
+
+
+# 📋 Report summary
+def _json_number(value):
+    """
+    Plain Python number for JSON output, with NaN as None
+    """
+    return None if pd.isna(value) else value.item() if hasattr(value, 'item') else value
+
+
+def holding_summary(holding_df):
+    """
+    Win rate and average holding time of winners and losers
+    """
+    is_winner = holding_df['is_winner'].astype(bool)
+    winners = holding_df.loc[is_winner, 'holding_minutes']
+    losers = holding_df.loc[~is_winner, 'holding_minutes']
+    return {
+        'matched_trades': len(holding_df),
+        'winning_trades': len(winners),
+        'losing_trades': len(losers),
+        'win_rate_pct': len(winners) / len(holding_df) * 100 if len(holding_df) else None,
+        'avg_hold_winners_min': _json_number(pd.to_numeric(winners).mean()),
+        'avg_hold_losers_min': _json_number(pd.to_numeric(losers).mean())
+    }
+
+
+def summarize_account(holding_df, cube):
+    """
+    Headline numbers of the Trading Kundali report as a JSON-friendly dict
+    """
+    by_day = pnl_table(cube, ['trade_weekday', 'trade_day_name']).droplevel('trade_weekday')
+    by_hour = pnl_table(cube, ['trade_hour'])
+    by_index = pnl_table(cube, ['index_name'])
+    summary = {
+        'total_fills': int(cube['trade_count'].sum()),
+        'indices_traded': int(cube['index_name'].nunique()),
+        'net_pnl': _json_number(by_index['pnl'].sum()),
+        'pnl_by_index': {str(name): _json_number(pnl) for name, pnl in by_index['pnl'].items()}
+    }
+    if 'charges' in by_index.columns:
+        summary.update(gross_pnl=_json_number(by_index['gross_pnl'].sum()),
+                       charges=_json_number(by_index['charges'].sum()))
+    summary.update(holding_summary(holding_df))
+    overall = performance_stats(holding_df)
+    for name in ('expectancy', 'max_drawdown', 'longest_win_streak', 'longest_loss_streak'):
+        summary[name] = _json_number(overall[name].iloc[0]) if len(overall) else None
+    for label, table in (('day', by_day), ('hour', by_hour)):
+        summary[f'best_{label}'] = _json_number(table['pnl'].idxmax()) if len(table) else None
+        summary[f'worst_{label}'] = _json_number(table['pnl'].idxmin()) if len(table) else None
+    return summary
+
+
+def report_tables(cube):
+    """
+    The report's day, hour and index PnL tables, by file name stem
+    """
+    return {
+        'pnl_by_day': pnl_table(cube, ['trade_weekday', 'trade_day_name']),
+        'pnl_by_hour': pnl_table(cube, ['trade_hour']),
+        'pnl_by_index': pnl_table(cube, ['index_name'])
+    }
+
+
+def analyze_trades(df, fee_schedule=None):
+    """
+    Run the full analysis on a validated tradebook, net of charges when a fee schedule is given.
+
+    Returns the enriched trades, the matched trades tagged with index_name, the
+    aggregation cube and the summary dict.
+    """
+    df = enrich_trades(df)
+    if fee_schedule is not None:
+        df = add_charges(df, fee_schedule)
+    holding_df = tag_index_name(calculate_holding_times(df), df)
+    cube = build_trade_cube(df)
+    return {
+        'trades': df,
+        'matched': holding_df,
+        'cube': cube,
+        'summary': {**summarize_account(holding_df, cube), 'behaviour': behaviour_summary(holding_df, cube)}
+    }
+
+
+# 📦 Large-data rendering helpers
+def time_slice(frame, column, start=None, end=None):
+    """
+    Rows with start <= frame[column] < end, for a frame sorted by `column`.
+
+    Two binary searches and a positional slice, so narrowing the range costs
+    O(log n) instead of a boolean mask over every row.
+    """
+    values = frame[column].to_numpy()
+    lo = 0 if start is None else values.searchsorted(pd.Timestamp(start).to_datetime64(), side='left')
+    hi = len(frame) if end is None else values.searchsorted(pd.Timestamp(end).to_datetime64(), side='left')
+    return frame.iloc[lo:hi]
+
+
+def holding_box_stats(holding_df, keys=()):
+    """
+    Box-plot statistics of holding_minutes per outcome (and per `keys`).
+
+    Whiskers follow the Tukey rule Plotly uses: the most extreme values within
+    1.5 IQR of the quartiles. The box plot can then be drawn from a few numbers
+    per box instead of shipping every matched trade to the browser.
+    """
+    keys = list(keys) + ['is_winner']
+    grouped = holding_df.groupby(keys, observed=True)['holding_minutes']
+    stats = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    stats.columns = ['q1', 'median', 'q3']
+    stats['mean'] = grouped.mean()
+    stats['count'] = grouped.size()
+
+    iqr = stats['q3'] - stats['q1']
+    bounds = pd.DataFrame({'low': stats['q1'] - 1.5 * iqr, 'high': stats['q3'] + 1.5 * iqr})
+    minutes = holding_df[keys + ['holding_minutes']].join(bounds, on=keys)
+    inside = minutes[minutes['holding_minutes'].between(minutes['low'], minutes['high'])]
+    fences = inside.groupby(keys, observed=True)['holding_minutes'].agg(lowerfence='min', upperfence='max')
+    return stats.join(fences).reset_index()
+
+
+def decimate(frame, columns, max_points=2000):
+    """
+    At most about max_points rows of an ordered frame, for plotting.
+
+    The frame is cut into equal slices and each keeps its first row plus the
+    rows holding the minimum and maximum of `columns`, so peaks and troughs
+    (e.g. the deepest drawdown) survive the thinning.
+    """
+    if len(frame) <= max_points:
+        return frame
+    buckets = max(max_points // (1 + 2 * len(columns)), 1)
+    bucket = np.arange(len(frame)) * buckets // len(frame)
+    positions = [np.flatnonzero(np.append(True, bucket[1:] != bucket[:-1])), [len(frame) - 1]]
+    for col in columns:
+        values = pd.Series(frame[col].to_numpy()).groupby(bucket)
+        positions += [values.idxmin().to_numpy(), values.idxmax().to_numpy()]
+    return frame.iloc[np.unique(np.concatenate(positions))]
+
+
+def sorted_page(frame, sort_by, ascending, page, page_size):
+    """
+    One page of `frame` sorted by `sort_by`, plus the page count.
+
+    Pages start at 1 and out-of-range page numbers are clamped, so a filter
+    that shrinks the table never leaves the reader on an empty page.
+    """
+    pages = max(-(-len(frame) // page_size), 1)
+    page = min(max(int(page), 1), pages)
+    start = (page - 1) * page_size
+    ordered = frame.sort_values(sort_by, ascending=ascending, kind='stable')
+    return ordered.iloc[start:start + page_size], page, pages
+
+
+def memory_report(frames):
+    """
+    Deep memory use of each column of each named frame, largest first.
+
+    `frames` maps a label (e.g. "trades") to a DataFrame. Returns one row per
+    column with its dtype, megabytes and bytes per row.
+    """
+    rows = []
+    for label, frame in frames.items():
+        usage = frame.memory_usage(index=True, deep=True)
+        for col, nbytes in usage.items():
+            rows.append({
+                'frame': label,
+                'column': col,
+                'dtype': str(frame.index.dtype if col == 'Index' else frame[col].dtype),
+                'mb': nbytes / 2**20,
+                'bytes_per_row': nbytes / len(frame) if len(frame) else None
+            })
+    report = pd.DataFrame(rows, columns=['frame', 'column', 'dtype', 'mb', 'bytes_per_row'])
+    return report.sort_values('mb', ascending=False, ignore_index=True)
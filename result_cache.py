@@ -0,0 +1,127 @@
+"""
+Disk-backed cache of analysis results, shared by every session and process.
+
+    cache = ResultCache('.pnl_cache', max_bytes=2 * 2**30)
+    trades = cache.load(file_digest, 'trades')     # None on a miss
+    cache.store(file_digest, 'trades', trades)
+
+Entries are keyed by the content hash of the uploaded file plus
+pnl_analysis.ANALYSIS_VERSION, so a repeat upload of the same export (by any
+user, after any restart) skips parsing and matching, and results computed by
+an older version of the analysis are never served. Each entry is a directory
+of frames in Parquet (pickle when pyarrow is not installed); a small SQLite
+index tracks their size and last use, and least recently used entries are
+deleted once the total passes max_bytes.
+"""
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+from pnl_analysis import ANALYSIS_VERSION
+
+try:
+    import pyarrow.parquet  # optional, columnar on-disk format
+    FRAME_FORMAT = 'parquet'
+except ImportError:
+    FRAME_FORMAT = 'pickle'
+
+DEFAULT_MAX_BYTES = 2 * 2**30
+
+
+def read_parquet(path, **kwargs):
+    """
+    Read a frame written by to_parquet, restoring every categorical column.
+
+    Arrow turns dictionary-encoded datetimes back into plain datetime64, so
+    categoricals are re-applied from the pandas metadata stored in the file.
+    Keyword arguments (columns, filters) go to pd.read_parquet.
+    """
+    frame = pd.read_parquet(path, **kwargs)
+    metadata = pyarrow.parquet.read_schema(path).pandas_metadata or {}
+    for column in metadata.get('columns', []):
+        name = column['name']
+        if (column['pandas_type'] == 'categorical' and name in frame.columns
+                and not isinstance(frame[name].dtype, pd.CategoricalDtype)):
+            frame[name] = frame[name].astype('category')
+    return frame
+
+
+class ResultCache:
+    """
+    Size-capped, least recently used store of DataFrames per upload digest
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, version=ANALYSIS_VERSION):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.version = version
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS entries '
+                       '(key TEXT PRIMARY KEY, bytes INTEGER NOT NULL, last_used REAL NOT NULL)')
+
+    def _connect(self):
+        return sqlite3.connect(self.directory / 'index.sqlite', timeout=30)
+
+    def _key(self, digest):
+        return f'{digest}-{self.version}'
+
+    def _path(self, digest, name):
+        return self.directory / self._key(digest) / f'{name}.{FRAME_FORMAT}'
+
+    def load(self, digest, name):
+        """
+        The frame stored under (digest, name), or None if it is not cached
+        """
+        path = self._path(digest, name)
+        try:
+            frame = read_parquet(path) if FRAME_FORMAT == 'parquet' else pd.read_pickle(path)
+        except FileNotFoundError:
+            return None
+        with self._connect() as db:
+            db.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), self._key(digest)))
+        return frame
+
+    def store(self, digest, name, frame):
+        """
+        Write a frame for (digest, name), then evict old entries past max_bytes
+        """
+        path = self._path(digest, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write under a temporary name so readers never see a partial file
+        partial = path.with_name(f'.{uuid.uuid4().hex}.{path.name}')
+        if FRAME_FORMAT == 'parquet':
+            frame.to_parquet(partial, index=False)
+        else:
+            frame.to_pickle(partial)
+        os.replace(partial, path)
+
+        size = sum(file.stat().st_size for file in path.parent.iterdir())
+        with self._connect() as db:
+            db.execute('INSERT INTO entries (key, bytes, last_used) VALUES (?, ?, ?) '
+                       'ON CONFLICT(key) DO UPDATE SET bytes = excluded.bytes, last_used = excluded.last_used',
+                       (self._key(digest), size, time.time()))
+        self.evict(keep=self._key(digest))
+
+    def evict(self, keep=None):
+        """
+        Delete least recently used entries until the cache fits in max_bytes
+        """
+        with self._connect() as db:
+            entries = db.execute('SELECT key, bytes FROM entries ORDER BY last_used DESC').fetchall()
+            total = 0
+            for key, size in entries:
+                total += size
+                if total > self.max_bytes and key != keep:
+                    db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                    shutil.rmtree(self.directory / key, ignore_errors=True)
+                    total -= size
+
+    def total_bytes(self):
+        with self._connect() as db:
+            return db.execute('SELECT COALESCE(SUM(bytes), 0) FROM entries').fetchone()[0]
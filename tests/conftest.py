@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The modules live at the repository root, next to app.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from tradebook_generator import generate_tradebook  # noqa: E402
+
+
+@pytest.fixture
+def tradebook_csv(tmp_path):
+    """
+    A generated tradebook with some sells dropped, so positions stay open, as a CSV
+    """
+    trades = generate_tradebook(4000, seed=3)
+    trades = trades.drop(index=trades.index[trades['trade_type'].eq('sell')][::7])
+    path = tmp_path / 'tradebook.csv'
+    trades.to_csv(path, index=False, date_format='%Y-%m-%dT%H:%M:%S')
+    return path
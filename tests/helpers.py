@@ -0,0 +1,33 @@
+"""
+Small tradebooks built by hand, and frame comparisons that ignore row order.
+"""
+import pandas as pd
+
+from pnl_analysis import LOT_COLUMNS
+
+START = pd.Timestamp('2024-04-01 09:15')
+MATCH_COLUMNS = ['symbol', 'buy_time', 'sell_time', 'quantity', 'pnl']
+
+
+def book(rows):
+    """
+    Fills from (symbol, minutes after START, trade_type, quantity, price) tuples
+    """
+    df = pd.DataFrame(rows, columns=['symbol', 'minute', 'trade_type', 'quantity', 'price'])
+    df['order_execution_time'] = START + pd.to_timedelta(df.pop('minute'), unit='m')
+    return df[LOT_COLUMNS]
+
+
+def random_book(rng, n):
+    return book(zip(rng.choice(['A', 'B', 'C'], n), rng.integers(0, 60, n), rng.choice(['buy', 'sell'], n),
+                    rng.integers(1, 6, n) * 25.0, rng.integers(80, 121, n).astype(float)))
+
+
+def assert_same_rows(frame, expected, columns=MATCH_COLUMNS):
+    """
+    Assert that `columns` of both frames hold the same rows, in any order
+    """
+    columns = list(columns)
+    sort = lambda table: (table[columns].astype({col: object for col in ('symbol', 'account') if col in columns})
+                          .sort_values(columns, kind='mergesort', ignore_index=True))
+    pd.testing.assert_frame_equal(sort(frame), sort(expected), check_dtype=False)
@@ -0,0 +1,30 @@
+"""
+Stage records and their totals.
+"""
+import time
+
+from instrumentation import StageRecorder
+
+
+def test_nested_stages_are_not_counted_twice():
+    recorder = StageRecorder()
+    with recorder.stage('outer'):
+        with recorder.stage('inner') as stage:
+            time.sleep(0.01)
+            stage['rows'] = 3.0
+    with recorder.stage('after'):
+        pass
+    records = {record['stage']: record for record in recorder.records}
+    assert [records[name]['depth'] for name in ('outer', 'inner', 'after')] == [0, 1, 0]
+    assert records['inner']['rows'] == 3
+    assert recorder.total_seconds() == records['outer']['seconds'] + records['after']['seconds']
+
+
+def test_memory_is_traced_once_for_the_outermost_stage():
+    recorder = StageRecorder(trace_memory=True)
+    with recorder.stage('outer'):
+        with recorder.stage('inner'):
+            bytearray(2**20)
+    records = {record['stage']: record for record in recorder.records}
+    assert records['outer']['peak_mb'] >= 1
+    assert records['inner']['peak_mb'] is None
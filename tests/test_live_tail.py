@@ -0,0 +1,72 @@
+"""
+Polling a growing tradebook checked against one full match of every fill.
+"""
+import pytest
+
+from helpers import MATCH_COLUMNS, assert_same_rows
+from live_tail import LiveTail
+from pnl_analysis import (
+    DEFAULT_FEE_SCHEDULE,
+    LOT_COLUMNS,
+    add_charges,
+    build_trade_cube,
+    concat_frames,
+    enrich_trades,
+    match_fifo,
+    pnl_table,
+    read_tradebook
+)
+
+
+def test_polls_match_a_full_rematch(tmp_path, tradebook_csv):
+    lines = tradebook_csv.read_bytes().splitlines(keepends=True)
+    live_csv = tmp_path / 'live.csv'
+    tail = LiveTail(live_csv)
+    # The second chunk ends mid-line, which must wait for the next poll
+    for start, end in ((0, 1), (1, 900), (900, 2500), (2500, len(lines))):
+        with open(live_csv, 'ab') as f:
+            f.writelines(lines[start:end])
+            if end == 900:
+                f.write(lines[900][:10])
+                lines[900] = lines[900][10:]
+        tail.poll()
+
+    trades = enrich_trades(read_tradebook(tradebook_csv))
+    full, full_lots = match_fifo(trades)
+    assert tail.fills == len(lines) - 1
+    assert_same_rows(tail.matched, full)
+    assert_same_rows(tail.open_lots, full_lots, LOT_COLUMNS)
+    assert tail.holding['trades'].sum() == len(full)
+    assert (pnl_table(tail.cube, ['index_name'])['pnl']
+            .equals(pnl_table(build_trade_cube(trades), ['index_name'])['pnl']))
+
+
+def test_drop_folder_reads_each_file_once(tmp_path, tradebook_csv):
+    header, *rows = tradebook_csv.read_text().splitlines(keepends=True)
+    tail = LiveTail(tmp_path)
+    (tmp_path / 'tradebook.csv').unlink()
+    (tmp_path / 'morning.csv').write_text(header + ''.join(rows[:1000]))
+    assert tail.poll() == 1000
+    assert tail.poll() == 0
+    (tmp_path / 'afternoon.csv').write_text(header + ''.join(rows[1000:]))
+    assert tail.poll() == len(rows) - 1000
+
+    full, _ = match_fifo(enrich_trades(concat_frames([read_tradebook(tmp_path / name)
+                                                      for name in ('morning.csv', 'afternoon.csv')])))
+    assert_same_rows(tail.matched, full)
+
+
+def test_charged_polls_match_a_full_net_rematch(tmp_path, tradebook_csv):
+    trades = add_charges(enrich_trades(read_tradebook(tradebook_csv)))
+    header, *rows = tradebook_csv.read_text().splitlines(keepends=True)
+    tail = LiveTail(tmp_path, DEFAULT_FEE_SCHEDULE)
+    (tmp_path / 'tradebook.csv').unlink()
+    for number, start in enumerate(range(0, len(rows), 1500)):
+        (tmp_path / f'part{number}.csv').write_text(header + ''.join(rows[start:start + 1500]))
+        tail.poll()
+
+    full, full_lots = match_fifo(trades)
+    assert tail.unpriced == 0
+    assert_same_rows(tail.matched, full, MATCH_COLUMNS + ['charges', 'gross_pnl'])
+    assert_same_rows(tail.open_lots, full_lots, LOT_COLUMNS)
+    assert tail.holding['pnl'].sum() == pytest.approx(full['pnl'].sum())
@@ -0,0 +1,339 @@
+"""
+Tradebook reading, option symbol decoding and charges, and FIFO matching,
+the performance stats and the behaviour flags checked against plain loops.
+"""
+import io
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers import START, assert_same_rows, book, random_book
+import pnl_analysis
+from pnl_analysis import (
+    LOT_COLUMNS,
+    decode_option_symbols,
+    equity_curve,
+    enrich_trades,
+    extend_matches,
+    fill_charges,
+    flag_overtrading_days,
+    flag_revenge_trades,
+    flag_size_escalation,
+    mark_to_market,
+    match_fifo,
+    merge_tradebooks,
+    open_inventory,
+    performance_stats,
+    read_tradebook,
+    round_trips,
+    time_slice
+)
+
+SAMPLE_CSV = Path(__file__).resolve().parents[1] / 'Sample.csv'
+
+
+@pytest.fixture(params=['pyarrow', 'c'])
+def csv_engine(request, monkeypatch):
+    if request.param == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    monkeypatch.setattr(pnl_analysis, 'CSV_ENGINE', request.param)
+
+
+def sample_csv(edit=lambda line: line, rows=3):
+    header, *lines = SAMPLE_CSV.read_text().splitlines()[:rows + 1]
+    return io.StringIO('\n'.join([header] + [edit(line) for line in lines]) + '\n')
+
+
+def test_read_tradebook_types_the_sample(csv_engine):
+    df = read_tradebook(sample_csv(), 'Sample.csv')
+    assert df['trade_id'].dtype == 'Int64'
+    assert df['order_execution_time'].dtype == 'datetime64[ns]'
+    assert df['order_execution_time'].iloc[0] == pd.Timestamp('2024-04-01 10:00:56')
+    assert isinstance(df['symbol'].dtype, pd.CategoricalDtype)
+
+
+def test_read_tradebook_keeps_text_ids(csv_engine):
+    df = read_tradebook(sample_csv(lambda line: line.replace(',774908506,', ',T774908506,')), 'x.csv')
+    assert df['trade_id'].tolist()[:2] == ['T774908506', '774919374']
+    assert df['order_id'].dtype == 'Int64'
+
+
+def test_read_tradebook_infers_non_iso_timestamps(csv_engine):
+    df = read_tradebook(sample_csv(lambda line: line.replace('2024-04-01T', '04/01/2024 ')), 'x.csv')
+    assert df['order_execution_time'].iloc[0] == pd.Timestamp('2024-04-01 10:00:56')
+
+
+def test_decode_option_symbols():
+    symbols = pd.Series(['FINNIFTY2440221300PE', 'NIFTY24O1722000CE', 'NIFTY24APR22000CE', 'NIFTY24APRFUT', 'INFY',
+                         'FINNIFTY2440221300PE'])
+    expiry_dates = pd.Series(['2024-04-02', '2024-10-17', '2024-04-25', '2024-04-25', None, '2024-04-02'])
+    contracts = decode_option_symbols(symbols, expiry_dates)
+    assert contracts['underlying'].tolist() == ['FINNIFTY', 'NIFTY', 'NIFTY', 'NIFTY', 'INFY', 'FINNIFTY']
+    assert contracts['expiry'].astype(object).tolist() == [pd.Timestamp(day) if day else pd.NaT for day in
+                                                           ['2024-04-02', '2024-10-17', '2024-04-25', '2024-04-25',
+                                                            None, '2024-04-02']]
+    assert contracts['strike'].astype(float).fillna(0).tolist() == [21300, 22000, 22000, 0, 0, 21300]
+    assert contracts['option_type'].astype(object).fillna('').tolist() == ['PE', 'CE', 'CE', 'FUT', '', 'PE']
+    assert all(isinstance(contracts[col].dtype, pd.CategoricalDtype) for col in contracts)
+
+
+def test_monthly_expiry_needs_the_expiry_date_column():
+    contracts = decode_option_symbols(pd.Series(['NIFTY24APR22000CE', 'FINNIFTY2440221300PE']))
+    assert contracts['expiry'].isna().tolist() == [True, False]
+
+
+def reference_fifo(trade_df):
+    """
+    Pair each symbol's buys and sells front to front, one lot at a time
+    """
+    matched, open_lots = [], []
+    trades = trade_df.sort_values(['symbol', 'order_execution_time'], kind='mergesort')
+    for symbol, fills in trades.groupby('symbol', sort=True):
+        queues = {side: deque([row.quantity, row.price, row.order_execution_time]
+                              for row in fills[fills['trade_type'] == side].itertuples())
+                  for side in ('buy', 'sell')}
+        buys, sells = queues['buy'], queues['sell']
+        while buys and sells:
+            quantity = min(buys[0][0], sells[0][0])
+            matched.append((symbol, buys[0][2], sells[0][2], quantity, (sells[0][1] - buys[0][1]) * quantity))
+            for lots in (buys, sells):
+                lots[0][0] -= quantity
+                if lots[0][0] == 0:
+                    lots.popleft()
+        for side, lots in queues.items():
+            open_lots.extend((symbol, time, side, quantity, price) for quantity, price, time in lots)
+    return (pd.DataFrame(matched, columns=['symbol', 'buy_time', 'sell_time', 'quantity', 'pnl']),
+            pd.DataFrame(open_lots, columns=LOT_COLUMNS))
+
+
+def test_match_fifo_agrees_with_reference():
+    rng = np.random.default_rng(7)
+    # 300 random books side by side, kept apart by a per-book symbol prefix
+    books = [random_book(rng, rng.integers(1, 40)) for _ in range(300)]
+    trades = pd.concat([trades.assign(symbol=f'{number}-' + trades['symbol']) for number, trades in enumerate(books)],
+                       ignore_index=True)
+    matched, open_lots = match_fifo(trades)
+    expected, expected_lots = reference_fifo(trades)
+    assert_same_rows(matched, expected)
+    assert_same_rows(open_lots, expected_lots, LOT_COLUMNS)
+
+
+def test_partial_fills_split_lots():
+    matched, open_lots = match_fifo(book([('A', 0, 'buy', 10, 100.0), ('A', 5, 'sell', 4, 110.0),
+                                          ('A', 9, 'sell', 6, 90.0)]))
+    assert matched['quantity'].tolist() == [4, 6]
+    assert matched['pnl'].tolist() == [40.0, -60.0]
+    assert matched['holding_minutes'].tolist() == [5.0, 9.0]
+    assert open_lots.empty
+
+
+def test_short_trades_match_later_buys():
+    matched, _ = match_fifo(book([('A', 0, 'sell', 5, 120.0), ('A', 30, 'buy', 5, 100.0)]))
+    assert matched['pnl'].tolist() == [100.0]
+    assert matched['holding_minutes'].tolist() == [30.0]
+    assert (matched['buy_time'] > matched['sell_time']).all()
+
+
+def test_open_lots_keep_the_unmatched_remainder():
+    _, open_lots = match_fifo(book([('A', 0, 'buy', 10, 100.0), ('A', 1, 'buy', 5, 101.0),
+                                    ('A', 2, 'sell', 12, 105.0)]))
+    assert open_lots[['trade_type', 'quantity', 'price']].values.tolist() == [['buy', 3, 101.0]]
+
+
+def test_extend_matches_continues_a_full_match():
+    rng = np.random.default_rng(11)
+    for _ in range(50):
+        trades = random_book(rng, 60).sort_values('order_execution_time', kind='mergesort', ignore_index=True)
+        cut = rng.integers(0, len(trades))
+        first, open_lots = match_fifo(trades.iloc[:cut])
+        later, later_lots = extend_matches(open_lots, trades.iloc[cut:])
+        full, full_lots = match_fifo(trades)
+        assert_same_rows(pd.concat([first, later], ignore_index=True), full)
+        assert_same_rows(later_lots, full_lots, LOT_COLUMNS)
+
+
+def random_matches(rng, n=400):
+    """
+    Matched trades of a random book, each symbol on its own index
+    """
+    matched, _ = match_fifo(random_book(rng, n))
+    return matched.assign(index_name=matched['symbol'].map({'A': 'NIFTY', 'B': 'BANKNIFTY', 'C': 'NIFTY'}))
+
+
+def reference_performance(holding_df):
+    """
+    Equity, drawdown and streak stats of one group, walking its trades in exit order
+    """
+    exits = sorted(zip(np.maximum(holding_df['buy_time'], holding_df['sell_time']), range(len(holding_df)),
+                       holding_df['pnl'], holding_df['is_winner']))
+    equity = peak = max_drawdown = 0.0
+    streak, longest = 0, {True: 0, False: 0}
+    previous = None
+    for _, _, pnl, is_winner in exits:
+        equity += pnl
+        peak = max(peak, equity)
+        max_drawdown = min(max_drawdown, equity - peak)
+        streak = streak + 1 if is_winner == previous else 1
+        previous = is_winner
+        longest[is_winner] = max(longest[is_winner], streak)
+    wins = [pnl for _, _, pnl, is_winner in exits if is_winner]
+    losses = [pnl for _, _, pnl, is_winner in exits if not is_winner]
+    return {'trades': len(exits), 'win_rate_pct': len(wins) / len(exits) * 100,
+            'net_pnl': sum(wins) + sum(losses), 'expectancy': (sum(wins) + sum(losses)) / len(exits),
+            'avg_win': np.mean(wins) if wins else np.nan, 'avg_loss': np.mean(losses) if losses else np.nan,
+            'max_drawdown': max_drawdown, 'longest_win_streak': longest[True], 'longest_loss_streak': longest[False]}
+
+
+def test_performance_stats_agree_with_a_plain_loop():
+    rng = np.random.default_rng(5)
+    for _ in range(20):
+        matched = random_matches(rng)
+        overall = performance_stats(matched).iloc[0]
+        for name, value in reference_performance(matched).items():
+            assert overall[name] == pytest.approx(value, nan_ok=True), name
+        by_index = performance_stats(matched, ['index_name']).set_index('index_name')
+        for index_name, trades in matched.groupby('index_name'):
+            for name, value in reference_performance(trades).items():
+                assert by_index.loc[index_name, name] == pytest.approx(value, nan_ok=True), (index_name, name)
+
+
+def test_equity_curve_peaks_start_from_zero():
+    matched = pd.DataFrame({'buy_time': START + pd.to_timedelta([0, 1, 2], unit='m'),
+                            'sell_time': START + pd.to_timedelta([5, 3, 4], unit='m'),
+                            'pnl': [50.0, -30.0, -40.0]}).assign(is_winner=lambda df: df['pnl'] > 0)
+    curve = equity_curve(matched)
+    # Exit order: 3, 4, then 5 minutes
+    assert curve['equity'].tolist() == [-30.0, -70.0, -20.0]
+    assert curve['peak'].tolist() == [0.0, 0.0, 0.0]
+    assert curve['drawdown'].tolist() == [-30.0, -70.0, -20.0]
+
+
+def test_behaviour_flags_agree_with_plain_loops():
+    rng = np.random.default_rng(9)
+    for _ in range(20):
+        trips = round_trips(random_matches(rng, 200))
+        revenge = flag_revenge_trades(trips, window_minutes=1)['is_revenge'].tolist()
+        escalation = flag_size_escalation(trips)['is_escalation'].tolist()
+        window = pd.Timedelta(minutes=1)
+        for number, trip in enumerate(trips.itertuples()):
+            assert revenge[number] == any(
+                not other.is_winner and trip.entry_time - window <= other.exit_time < trip.entry_time
+                for other in trips.itertuples())
+            # The last trip of the index (in trips order for equal exits) that exited before this entry
+            earlier = [(other.exit_time, position, other) for position, other in enumerate(trips.itertuples())
+                       if other.index_name == trip.index_name and other.exit_time < trip.entry_time]
+            previous = max(earlier, key=lambda item: item[:2])[2] if earlier else None
+            assert escalation[number] == (previous is not None and previous.pnl <= 0
+                                          and trip.quantity > previous.quantity)
+
+
+def test_overtrading_days_agree_with_a_plain_loop():
+    rng = np.random.default_rng(3)
+    days = pd.bdate_range('2024-01-01', periods=60)
+    fills = rng.integers(5, 30, len(days)) * np.where(rng.random(len(days)) < 0.15, 4, 1)
+    cube = pd.DataFrame({'trade_date': days, 'trade_count': fills})
+    matched = pd.DataFrame({'buy_time': days + pd.Timedelta(hours=10), 'sell_time': days + pd.Timedelta(hours=11),
+                            'pnl': rng.normal(0, 100, len(days))})
+    flagged = flag_overtrading_days(cube, matched, window=20, threshold=2.0)
+    for number in range(len(days)):
+        before = fills[max(number - 20, 0):number]
+        baseline = np.median(before) if len(before) >= 5 else np.nan
+        assert flagged['is_spike'].iloc[number] == (fills[number] > 2.0 * baseline)
+        assert flagged['pnl'].iloc[number] == pytest.approx(matched['pnl'].iloc[number])
+    assert flagged['is_spike'].any()
+
+
+def test_time_slice_matches_a_boolean_mask():
+    rng = np.random.default_rng(2)
+    times = np.sort(START + pd.to_timedelta(rng.integers(0, 10 * 24 * 60, 500), unit='m'))
+    frame = pd.DataFrame({'order_execution_time': times, 'row': np.arange(len(times))})
+    column = frame['order_execution_time']
+    for start, end in ((None, None), ('2024-04-03', None), (None, '2024-04-05'), ('2024-04-03', '2024-04-05'),
+                       (times[100], times[100]), (times[100], times[300]), ('2030-01-01', None)):
+        mask = pd.Series(True, index=frame.index)
+        if start is not None:
+            mask &= column >= pd.Timestamp(start)
+        if end is not None:
+            mask &= column < pd.Timestamp(end)
+        assert time_slice(frame, 'order_execution_time', start, end)['row'].tolist() == frame.loc[mask, 'row'].tolist()
+
+
+def test_accounts_never_net():
+    trades = merge_tradebooks([book([('A', 0, 'buy', 10, 100.0)]), book([('A', 5, 'sell', 10, 110.0)])],
+                              ['one', 'two'])
+    matched, open_lots = match_fifo(trades)
+    assert matched.empty
+    assert sorted(open_lots['account'].astype(str)) == ['one', 'two']
+
+
+def test_merge_tradebooks_drops_repeats_within_an_account_only():
+    fills = book([('A', 0, 'buy', 10, 100.0), ('A', 5, 'sell', 10, 110.0)]).assign(trade_id=[1, 2], order_id=[7, 8])
+    no_ids = fills.drop(columns=['trade_id', 'order_id'])
+    merged = merge_tradebooks([fills, fills.iloc[1:], fills, no_ids, no_ids], ['one', 'one', 'two', 'two', 'two'])
+    assert merged['account'].astype(str).value_counts().to_dict() == {'one': 2, 'two': 6}
+
+
+def test_fill_charges_by_hand():
+    trades = pd.DataFrame({
+        'symbol': pd.Categorical(['NIFTY24APR22000CE', 'NIFTY24APR22000CE', 'NIFTY24APRFUT', 'INFY']),
+        'order_execution_time': START + pd.to_timedelta([0, 0, 5, 10], unit='m'),
+        'trade_type': ['buy', 'buy', 'sell', 'buy'],
+        'quantity': [25, 25, 25, 10],
+        'price': [100.0, 100.0, 22000.0, 1500.0],
+        'exchange': 'NSE',
+        'segment': ['FO', 'FO', 'FO', 'EQ'],
+        'order_id': [1, 1, 2, 3]
+    })
+    charges = fill_charges(enrich_trades(trades))
+    # Option buy, one order of two 2,500 fills: ₹20 brokerage split by value, no STT on buys
+    option = 10 + 2500 * 0.03503 / 100 + 2500 * 10 / 1e7 + 2500 * 0.003 / 100
+    option += (10 + 2500 * 0.03503 / 100 + 2500 * 10 / 1e7) * 0.18
+    # Future sell of 5,50,000: brokerage capped at ₹20, STT on the sell, no stamp duty
+    future = 20 + 550000 * 0.02 / 100 + 550000 * 0.00173 / 100 + 550000 * 10 / 1e7
+    future += (20 + 550000 * 0.00173 / 100 + 550000 * 10 / 1e7) * 0.18
+    # Intraday equity buy of 15,000: brokerage is 0.03% (below ₹20), stamp duty but no STT on the buy
+    equity = 4.5 + 15000 * 0.00297 / 100 + 15000 * 10 / 1e7 + 15000 * 0.003 / 100
+    equity += (4.5 + 15000 * 0.00297 / 100 + 15000 * 10 / 1e7) * 0.18
+    assert charges.tolist() == pytest.approx([option, option, future, equity])
+
+
+def test_fill_charges_leave_unscheduled_fills_nan():
+    trades = book([('NIFTY24APR22000CE', 0, 'buy', 25, 100.0)]).assign(exchange='MCX', segment='FO')
+    assert fill_charges(enrich_trades(trades)).isna().all()
+
+
+def open_book():
+    """
+    A long option, a short future and an unmatched equity buy, all still open
+    """
+    trades = enrich_trades(book([('NIFTY24APR22000CE', 0, 'buy', 25, 100.0), ('NIFTY24APRFUT', 5, 'sell', 25, 22000.0),
+                                 ('INFY', 10, 'buy', 10, 1500.0)]))
+    _, open_lots = match_fifo(trades)
+    return open_inventory(open_lots, trades)
+
+
+def test_mark_to_market_leaves_lots_without_prices_unpriced():
+    inventory = open_book()
+    prices = pd.DataFrame({'symbol': pd.Categorical(['TCS']), 'timestamp': [START + pd.Timedelta('1h')],
+                           'price': [4000.0]})
+    for no_overlap in (prices, prices.iloc[:0]):
+        marked = mark_to_market(inventory, no_overlap)
+        assert len(marked) == len(inventory)
+        assert marked[['mark_price', 'marked_at', 'market_value', 'unrealized_pnl']].isna().all().all()
+        assert marked['marked_at'].dtype == 'datetime64[ns]'
+
+
+def test_mark_to_market_prices_only_the_symbols_it_has():
+    inventory = open_book()
+    prices = pd.DataFrame({'symbol': pd.Categorical(['NIFTY24APRFUT', 'TCS', 'NIFTY24APR22000CE', 'NIFTY24APRFUT']),
+                           'timestamp': START + pd.to_timedelta([1, 20, 30, 40], unit='m'),
+                           'price': [21000.0, 4000.0, 120.0, 21900.0]})
+    marked = mark_to_market(inventory, prices).set_index('symbol')
+    assert marked.loc['NIFTY24APR22000CE', 'unrealized_pnl'] == (120.0 - 100.0) * 25
+    # The future was sold at minute 5, so its minute-1 price is too old and the minute-40 one counts
+    assert marked.loc['NIFTY24APRFUT', 'market_value'] == -21900.0 * 25
+    assert marked.loc['NIFTY24APRFUT', 'unrealized_pnl'] == (22000.0 - 21900.0) * 25
+    assert np.isnan(marked.loc['INFY', 'mark_price'])
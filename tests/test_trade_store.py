@@ -0,0 +1,101 @@
+"""
+Incremental ingests checked against one full match of every fill.
+"""
+import shutil
+
+import numpy as np
+import pytest
+
+from helpers import MATCH_COLUMNS, assert_same_rows
+from pnl_analysis import (
+    DEFAULT_FEE_SCHEDULE,
+    LOT_COLUMNS,
+    add_charges,
+    enrich_trades,
+    fill_charges,
+    match_fifo,
+    merge_tradebooks,
+    read_tradebook
+)
+
+pytest.importorskip('pyarrow')
+from trade_store import TradeStore  # noqa: E402
+
+
+def ingest_in_parts(store, trades, fee_schedule=None):
+    """
+    Overlapping exports, with the last third arriving before the middle one (a backfill)
+    """
+    thirds = np.array_split(np.arange(len(trades)), 3)
+    return [store.ingest(trades.iloc[rows], fee_schedule) for rows in
+            (thirds[0], np.concatenate([thirds[0], thirds[2]]), thirds[1], thirds[1])]
+
+
+def test_ingests_match_a_full_rematch(tmp_path, tradebook_csv):
+    trades = read_tradebook(tradebook_csv)
+    store = TradeStore(tmp_path / 'store')
+    stats = ingest_in_parts(store, trades)
+    first, middle, _ = (len(rows) for rows in np.array_split(trades.index, 3))
+    assert [part['duplicates'] for part in stats] == [0, first, 0, middle]
+    assert stats[2]['rematched_symbols'] > 0
+
+    full, full_lots = match_fifo(enrich_trades(trades.copy()))
+    _, stored, matched, open_lots, _ = store.snapshot()
+    assert len(stored) == len(trades)
+    assert_same_rows(matched, full)
+    assert_same_rows(open_lots, full_lots, LOT_COLUMNS)
+
+
+def test_accounts_are_deduplicated_and_matched_apart(tmp_path, tradebook_csv):
+    # Two accounts with the same trade and order ids, exported together
+    trades = read_tradebook(tradebook_csv)
+    both = merge_tradebooks([trades, trades], ['one', 'two'])
+    store = TradeStore(tmp_path / 'store')
+    stats = ingest_in_parts(store, both)
+    assert sum(part['new_fills'] for part in stats) == len(both)
+
+    full, full_lots = match_fifo(enrich_trades(both.copy()))
+    _, stored, matched, open_lots, _ = store.snapshot()
+    assert stored['account'].astype(str).value_counts().to_dict() == {'one': len(trades), 'two': len(trades)}
+    assert_same_rows(matched, full, ['account'] + MATCH_COLUMNS)
+    assert_same_rows(open_lots, full_lots, ['account'] + LOT_COLUMNS)
+    with pytest.raises(ValueError):
+        store.ingest(trades)
+
+
+def test_digest_changes_with_contents_even_in_a_recreated_store(tmp_path, tradebook_csv):
+    trades = read_tradebook(tradebook_csv)
+    store = TradeStore(tmp_path / 'store')
+    store.ingest(trades.iloc[:1000])
+    first = store.digest
+    store.ingest(trades.iloc[:1000])
+    assert store.digest == first  # nothing new, nothing written
+
+    shutil.rmtree(tmp_path / 'store')
+    recreated = TradeStore(tmp_path / 'store')
+    recreated.ingest(trades.iloc[1000:])
+    assert recreated.generation == 1
+    assert recreated.digest != first
+    assert TradeStore(tmp_path / 'store').digest == recreated.digest
+
+
+def test_charged_ingests_match_a_full_net_rematch(tmp_path, tradebook_csv):
+    trades = read_tradebook(tradebook_csv)
+    store = TradeStore(tmp_path / 'store')
+    store.ingest(trades.iloc[:1000])
+    # A fee schedule after the fact re-charges what is already stored
+    stats = ingest_in_parts(store, trades, DEFAULT_FEE_SCHEDULE)
+    assert store.fee_schedule() is not None
+    assert stats[0]['unpriced'] == 0
+
+    full, full_lots = match_fifo(add_charges(enrich_trades(trades.copy())))
+    _, stored, matched, open_lots, cube = store.snapshot()
+    assert stored['charges'].sum() == pytest.approx(fill_charges(enrich_trades(trades.copy()),
+                                                                 DEFAULT_FEE_SCHEDULE).sum())
+    assert_same_rows(matched, full, MATCH_COLUMNS + ['charges', 'gross_pnl'])
+    assert_same_rows(open_lots, full_lots, LOT_COLUMNS)
+    assert cube['charges'].sum() == pytest.approx(stored['charges'].sum())
+
+    store.ingest(trades)  # back to gross
+    assert store.fee_schedule() is None
+    assert_same_rows(store.matched(), match_fifo(enrich_trades(trades.copy()))[0])
@@ -0,0 +1,359 @@
+"""
+Append-only local store of one account's fills, ingested incrementally.
+
+    python trade_store.py STORE_DIR TRADEBOOK [TRADEBOOK ...] [--fees [SCHEDULE_CSV]]
+
+Brokers export the whole history every time, so most of each upload repeats
+fills the store already has. ingest() drops those by (trade_id, order_id),
+within their account when the fills carry one (pnl_analysis.merge_tradebooks),
+appends only the new fills as a Parquet part and updates the matched trades,
+open lots and aggregation cube from the new fills alone: FIFO matching
+continues from the open lots (pnl_analysis.extend_matches) and the cube is a
+sum. Only a symbol that receives a fill older than its latest stored one (a
+backfill) is re-matched from its full history.
+
+With a fee schedule, the new fills are charged before they are matched and
+aggregated, and the charges are stored with them, so matched trades, open
+lots and the cube stay net of charges at the same incremental cost. The
+schedule is kept in the manifest; ingesting with a different one (or none)
+re-charges the whole history once.
+
+Every ingest writes new files and then replaces manifest.json, which lists
+the files that make up the store, so a crash mid-ingest leaves the previous
+state intact. Writers take an exclusive lock on the store's .lock file, so
+concurrent ingests (two app sessions, or the app and this CLI) run one after
+the other, each on top of the other's manifest.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from pnl_analysis import (
+    ANALYSIS_VERSION,
+    DEFAULT_FEE_SCHEDULE,
+    EMPTY_LOTS,
+    EMPTY_MATCHES,
+    FEE_RATE_COLUMNS,
+    FEE_SCHEDULE_KEYS,
+    TRADEBOOK_SCHEMA,
+    build_trade_cube,
+    concat_frames,
+    enrich_trades,
+    extend_matches,
+    fill_charges,
+    match_fifo,
+    merge_cubes,
+    merge_tradebooks,
+    missing_columns,
+    position_keys,
+    read_fee_schedule,
+    read_tradebook,
+    tag_index_name
+)
+from result_cache import read_parquet
+
+try:
+    import fcntl  # POSIX advisory locks, so separate processes take turns too
+except ImportError:
+    fcntl = None
+
+DEDUPE_KEYS = ['trade_id', 'order_id']
+MANIFEST = 'manifest.json'
+LOCK_FILE = '.lock'
+_thread_locks = {}  # store directory -> lock shared by the threads (app sessions) of this process
+_thread_locks_guard = threading.Lock()
+
+
+def _schedule_records(schedule):
+    """
+    A fee schedule as JSON-friendly rows for the manifest (None when fills are not charged)
+    """
+    if schedule is None:
+        return None
+    return json.loads(schedule[FEE_SCHEDULE_KEYS + FEE_RATE_COLUMNS].to_json(orient='records'))
+
+
+class TradeStore:
+    """
+    Deduplicated fills of one account (or of several, tagged by account) plus their matched trades, open lots and cube
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._reload()
+        if self.manifest['version'] != ANALYSIS_VERSION:
+            self.rebuild()
+
+    def _reload(self):
+        manifest_path = self.directory / MANIFEST
+        if manifest_path.exists():
+            self.manifest = json.loads(manifest_path.read_text())
+        else:
+            self.manifest = self._empty_manifest(generation=0)
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold the store's write lock and pick up whatever the previous writer committed
+        """
+        with _thread_locks_guard:
+            thread_lock = _thread_locks.setdefault(self.directory.resolve(), threading.Lock())
+        with thread_lock, open(self.directory / LOCK_FILE, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._reload()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _empty_manifest(generation):
+        return {'version': ANALYSIS_VERSION, 'generation': generation, 'accounts': False, 'fee_schedule': None,
+                'trade_parts': [], 'matched_parts': [], 'open_lots': None, 'cube': None, 'symbols': None}
+
+    @property
+    def generation(self):
+        """
+        Number of the last ingest that added fills; changes whenever the contents do
+        """
+        return self.manifest['generation']
+
+    @property
+    def digest(self):
+        """
+        Hash of the files that make up the store, to key results computed from its contents.
+
+        Part names carry a random token, so unlike generation this never
+        repeats for different contents, even when the directory is recreated.
+        """
+        parts = {key: self.manifest[key] for key in ('version', 'accounts', 'fee_schedule', 'trade_parts',
+                                                    'matched_parts', 'open_lots', 'cube', 'symbols')
+                 if key in self.manifest}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def fee_schedule(self):
+        """
+        The fee schedule the stored fills are charged by, or None when they are gross
+        """
+        records = self.manifest.get('fee_schedule')
+        return None if records is None else pd.DataFrame(records, columns=FEE_SCHEDULE_KEYS + FEE_RATE_COLUMNS)
+
+    def snapshot(self):
+        """
+        Latest (digest, trades, matched trades, open lots, cube), read under the write lock.
+
+        A commit deletes the files of the previous version, so readers that may
+        run alongside an ingest (other app sessions) should read through here.
+        """
+        with self._locked():
+            return self.digest, self.trades(), self.matched(), self.open_lots(), self.cube()
+
+    def _read(self, name, **kwargs):
+        return read_parquet(self.directory / name, **kwargs)
+
+    def _write(self, frame, kind, generation):
+        # A random token makes every part name unique, even across recreated stores (see digest)
+        name = f'{kind}-{generation:06d}-{uuid.uuid4().hex[:12]}.parquet'
+        # Write under a temporary name so a crash never leaves a partial file
+        partial = self.directory / f'.{uuid.uuid4().hex}.{name}'
+        frame.to_parquet(partial, index=False)
+        os.replace(partial, self.directory / name)
+        return name
+
+    def _read_trades(self, parts, symbols=None, columns=None):
+        filters = [('symbol', 'in', list(symbols))] if symbols is not None else None
+        frames = [self._read(part, columns=columns, filters=filters) for part in parts]
+        return concat_frames(frames) if frames else pd.DataFrame(columns=columns)
+
+    def trades(self, symbols=None):
+        """
+        All stored fills (enriched), optionally only those of `symbols`
+        """
+        return self._read_trades(self.manifest['trade_parts'], symbols)
+
+    def matched(self):
+        """
+        FIFO-matched trades tagged with index_name, as calculate_holding_times would return them
+        """
+        frames = [self._read(part) for part in self.manifest['matched_parts']]
+        return pd.concat(frames, ignore_index=True) if frames else EMPTY_MATCHES.assign(index_name=pd.Series(dtype=object))
+
+    def open_lots(self):
+        """
+        Quantity bought or sold that is not matched yet, as fills
+        """
+        return self._read(self.manifest['open_lots']) if self.manifest['open_lots'] else EMPTY_LOTS.copy()
+
+    def cube(self):
+        return self._read(self.manifest['cube']) if self.manifest['cube'] else merge_cubes()
+
+    def _symbols(self):
+        """
+        index_name and latest fill time of every stored symbol
+        """
+        if self.manifest['symbols']:
+            return self._read(self.manifest['symbols'])
+        return pd.DataFrame({'symbol': pd.Series(dtype=object), 'index_name': pd.Series(dtype=object),
+                             'last_time': pd.Series(dtype='datetime64[ns]')})
+
+    def ingest(self, df, fee_schedule=None):
+        """
+        Add the fills of a tradebook (as read by read_tradebook) that are not stored yet.
+
+        Only the TRADEBOOK_SCHEMA columns (and account) are kept, so an already
+        enriched frame can be passed in too. With an account column, fills are
+        deduplicated and matched within their account; a store keeps either
+        account-tagged fills or untagged ones, never both. With fee_schedule
+        every PnL is net of charges (see pnl_analysis.add_charges).
+
+        Returns counts of fills seen, new fills, duplicates skipped, symbols
+        re-matched because of backfilled fills, newly matched trades and new
+        fills the fee schedule has no row for (counted without charges).
+        """
+        with self._locked():
+            if self.manifest['trade_parts'] and self.manifest.get('fee_schedule') != _schedule_records(fee_schedule):
+                # Every stored fill has to be charged by the new schedule
+                self._rebuild(fee_schedule)
+            return self._ingest(df, fee_schedule)
+
+    def _ingest(self, df, fee_schedule):
+        missing_cols = missing_columns(df) + [key for key in DEDUPE_KEYS[:1] if key not in df.columns]
+        if missing_cols:
+            raise ValueError(f"missing columns: {', '.join(missing_cols)}")
+        df = df[[col for col in [*TRADEBOOK_SCHEMA, 'account'] if col in df.columns]]
+        has_accounts = 'account' in df.columns
+        if self.manifest['trade_parts'] and self.manifest.get('accounts', False) != has_accounts:
+            raise ValueError("fills with and without an account cannot share one history")
+        keys = position_keys(df)[:-1] + [key for key in DEDUPE_KEYS if key in df.columns]
+        if df[keys].isna().any().any():
+            raise ValueError(f"fills without {'/'.join(keys)} cannot be deduplicated")
+
+        fills = df.drop_duplicates(keys)
+        stored = self._read_trades(self.manifest['trade_parts'], columns=keys)
+        if len(stored):
+            # Stored keys are unique, so a left join keeps one row per fill in order
+            seen = fills[keys].merge(stored[keys], how='left', on=keys, indicator=True)['_merge']
+            fills = fills[(seen == 'left_only').to_numpy()]
+        stats = {'fills': len(df), 'new_fills': len(fills), 'duplicates': len(df) - len(fills),
+                 'rematched_symbols': 0, 'new_matches': 0, 'unpriced': 0}
+        if fills.empty:
+            return stats
+        fills = fills.reset_index(drop=True)
+        for col in fills.select_dtypes('category'):
+            fills[col] = fills[col].cat.remove_unused_categories()
+        new = enrich_trades(fills)
+        if fee_schedule is not None:
+            charges = fill_charges(new, fee_schedule)
+            stats['unpriced'] = int(charges.isna().sum())
+            new['charges'] = charges.fillna(0)
+
+        # A symbol whose new fills start before its latest stored fill is re-matched in full
+        symbols = self._symbols().set_index('symbol')
+        first_new = new.groupby('symbol', observed=True)['order_execution_time'].min()
+        first_new.index = first_new.index.astype(object)
+        backfilled = first_new.index[first_new < symbols['last_time'].reindex(first_new.index)]
+
+        generation = self.generation + 1
+        manifest = dict(self.manifest, generation=generation, accounts=has_accounts,
+                        fee_schedule=_schedule_records(fee_schedule))
+        manifest['trade_parts'] = self.manifest['trade_parts'] + [self._write(new, 'trades', generation)]
+
+        open_lots = self.open_lots()
+        matched, open_lots = extend_matches(open_lots[~open_lots['symbol'].isin(backfilled)],
+                                            new[~new['symbol'].isin(backfilled)])
+        new_symbols = (new.groupby('symbol', observed=True)
+                       .agg(index_name=('index_name', 'first'), last_time=('order_execution_time', 'max'))
+                       .reset_index().astype({'symbol': object, 'index_name': object}))
+        symbols = (pd.concat([symbols.reset_index(), new_symbols], ignore_index=True)
+                   .groupby('symbol', sort=True).agg(index_name=('index_name', 'first'), last_time=('last_time', 'max'))
+                   .reset_index())
+        matched = tag_index_name(matched, symbols)
+        stats['new_matches'] = len(matched)
+
+        if len(backfilled):
+            history = self._read_trades(manifest['trade_parts'], symbols=backfilled)
+            rematched, reopened = match_fifo(history)
+            stored_matched = self.matched()
+            matched = pd.concat([stored_matched[~stored_matched['symbol'].isin(backfilled)], matched,
+                                 tag_index_name(rematched, symbols)], ignore_index=True)
+            open_lots = pd.concat([open_lots, reopened], ignore_index=True)
+            manifest['matched_parts'] = [self._write(matched, 'matched', generation)]
+            stats['rematched_symbols'] = len(backfilled)
+        elif len(matched):
+            manifest['matched_parts'] = (self.manifest['matched_parts']
+                                         + [self._write(matched, 'matched', generation)])
+
+        manifest['open_lots'] = self._write(open_lots, 'open_lots', generation)
+        manifest['cube'] = self._write(merge_cubes(self.cube(), build_trade_cube(new)), 'cube', generation)
+        manifest['symbols'] = self._write(symbols, 'symbols', generation)
+        self._commit(manifest)
+        return stats
+
+    def rebuild(self):
+        """
+        Re-enrich, re-charge and re-match every stored fill, e.g. after ANALYSIS_VERSION changes
+        """
+        with self._locked():
+            self._rebuild(self.fee_schedule())
+
+    def _rebuild(self, fee_schedule):
+        trades = self._read_trades(self.manifest['trade_parts'])
+        self.manifest = self._empty_manifest(self.manifest['generation'])
+        if len(trades):
+            self._ingest(trades, fee_schedule)
+        else:
+            self._commit(self.manifest)
+
+    def _commit(self, manifest):
+        """
+        Atomically switch to `manifest`, then delete files it no longer lists
+        """
+        partial = self.directory / f'.{uuid.uuid4().hex}.{MANIFEST}'
+        partial.write_text(json.dumps(manifest, indent=2))
+        os.replace(partial, self.directory / MANIFEST)
+        self.manifest = manifest
+
+        in_use = set(manifest['trade_parts'] + manifest['matched_parts'])
+        in_use.update(manifest[name] for name in ('open_lots', 'cube', 'symbols'))
+        for path in self.directory.glob('*.parquet'):
+            if path.name not in in_use:
+                path.unlink()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add tradebooks to an incremental trade store.")
+    parser.add_argument('store_dir', type=Path, help="directory of the account's trade store")
+    parser.add_argument('tradebooks', type=Path, nargs='+', help="CSV/Excel tradebooks, oldest first")
+    parser.add_argument('--account', help="tag every fill with this account (as the app does), so the store "
+                                          "can hold several accounts")
+    parser.add_argument('--fees', nargs='?', const='default', metavar='SCHEDULE_CSV',
+                        help="deduct brokerage and taxes, from this fee schedule (default schedule if no file)")
+    args = parser.parse_args(argv)
+
+    fee_schedule = None
+    if args.fees:
+        fee_schedule = DEFAULT_FEE_SCHEDULE if args.fees == 'default' else read_fee_schedule(args.fees)
+    store = TradeStore(args.store_dir)
+    for path in args.tradebooks:
+        df = read_tradebook(path)
+        if args.account:
+            df = merge_tradebooks([df], [args.account])
+        stats = store.ingest(df, fee_schedule)
+        print(f"✅ {path.name}: {stats['new_fills']:,} new fills, {stats['duplicates']:,} already stored, "
+              f"{stats['new_matches']:,} new matched trades, {stats['rematched_symbols']:,} symbols re-matched")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
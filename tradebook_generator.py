@@ -0,0 +1,163 @@
+"""
+Synthetic tradebooks in the broker export schema of Sample.csv.
+
+    python tradebook_generator.py trades_1m.csv --rows 1000000
+
+Generates intraday FINNIFTY/NIFTY/BANKNIFTY option round trips: a buy and a
+later sell of the same contract and quantity, on weekly or monthly expiry
+symbols near the day's spot. Trips are spread over consecutive weekdays and
+written day block by day block in time order, so even 10M rows are
+produced with bounded memory. Bigger books trade more per day rather than
+over more days, so every size spans at most MAX_TRADE_DAYS (about two
+years) and its expiry symbols stay realistic.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+TRADEBOOK_COLUMNS = ['symbol', 'isin', 'trade_date', 'exchange', 'segment', 'series', 'trade_type', 'auction',
+                     'quantity', 'price', 'trade_id', 'order_id', 'order_execution_time', 'expiry_date']
+
+# underlying: (starting spot, strike step, lot size, weekly expiry weekday)
+INDEX_CONTRACTS = {
+    'NIFTY': (22000, 50, 25, 3),
+    'BANKNIFTY': (48000, 100, 15, 2),
+    'FINNIFTY': (21000, 50, 40, 1)
+}
+TRIPS_PER_DAY = 200  # at least; raised for books that would run past MAX_TRADE_DAYS
+MAX_TRADE_DAYS = 500
+FIRST_TRADE_DAY = '2021-01-04'
+MARKET_OPEN_SECONDS = (9 * 60 + 15) * 60
+MARKET_CLOSE_SECONDS = (15 * 60 + 30) * 60
+WEEKLY_MONTH_CODES = np.array(list('123456789OND'))
+MONTH_NAMES = np.array(['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'])
+
+
+def _spot_paths(rng, n_days):
+    """
+    Daily closing spot of every index as a random walk, shape (indices, days)
+    """
+    starts = np.array([spot for spot, _, _, _ in INDEX_CONTRACTS.values()], dtype=float)
+    returns = rng.normal(0, 0.01, size=(len(starts), n_days))
+    return starts[:, None] * np.exp(np.cumsum(returns, axis=1))
+
+
+def _round_to_tick(prices, tick=0.05):
+    return np.maximum(np.round(prices / tick) * tick, tick).round(2)
+
+
+def _expiry_calendar(days):
+    """
+    Expiry date and symbol prefix of the nearest expiry on or after each day,
+    shape (indices, days)
+
+    The last weekly expiry of a month is the monthly contract, which uses the
+    "NIFTY24APR22000CE" symbol format instead of "NIFTY2440422000CE".
+    """
+    calendar = {'date': [], 'prefix': []}
+    for name, (_, _, _, weekday) in INDEX_CONTRACTS.items():
+        expiry = days + pd.to_timedelta((weekday - days.dayofweek.to_numpy()) % 7, unit='D')
+        year = expiry.strftime('%y').to_numpy(dtype=object)
+        weekly_prefix = (name + year + WEEKLY_MONTH_CODES[expiry.month - 1].astype(object)
+                         + expiry.strftime('%d').to_numpy(dtype=object))
+        monthly_prefix = name + year + MONTH_NAMES[expiry.month - 1].astype(object)
+        monthly = (expiry + pd.Timedelta(days=7)).month != expiry.month
+        calendar['date'].append(expiry.strftime('%Y-%m-%d').to_numpy(dtype=object))
+        calendar['prefix'].append(np.where(monthly, monthly_prefix, weekly_prefix))
+    return {key: np.array(rows) for key, rows in calendar.items()}
+
+
+def _trip_block(rng, trip_start, trip_end, trips_per_day, days, spots, calendar):
+    """
+    Buy and sell fills of trips [trip_start, trip_end), sorted by execution time
+    """
+    n = trip_end - trip_start
+    _, strike_steps, lot_sizes, _ = (np.array(values) for values in zip(*INDEX_CONTRACTS.values()))
+
+    day = np.arange(trip_start, trip_end) // trips_per_day
+    index = rng.integers(0, len(INDEX_CONTRACTS), n)
+    trade_day = days[day]
+
+    step = strike_steps[index]
+    strike = (np.round(spots[index, day] / step) + rng.integers(-5, 6, n)) * step
+    option_type = np.where(rng.random(n) < 0.5, 'CE', 'PE').astype(object)
+    symbol = calendar['prefix'][index, day] + strike.astype(np.int64).astype(str).astype(object) + option_type
+
+    entry_seconds = rng.integers(MARKET_OPEN_SECONDS, MARKET_CLOSE_SECONDS - 600, n)
+    hold_seconds = np.minimum(rng.exponential(8 * 60, n).astype(np.int64) + 5,
+                              MARKET_CLOSE_SECONDS - 1 - entry_seconds)
+    buy_time = trade_day + pd.to_timedelta(entry_seconds, unit='s')
+    sell_time = buy_time + pd.to_timedelta(hold_seconds, unit='s')
+
+    quantity = (lot_sizes[index] * rng.integers(1, 11, n)).astype(float)
+    buy_price = _round_to_tick(rng.lognormal(np.log(120), 0.5, n))
+    sell_price = _round_to_tick(buy_price * (1 + rng.normal(0, 0.1, n)))
+
+    fills = pd.DataFrame({
+        'symbol': np.tile(symbol, 2),
+        'trade_type': np.repeat(['buy', 'sell'], n),
+        'quantity': np.concatenate([quantity, quantity]),
+        'price': np.concatenate([buy_price, sell_price]),
+        'order_execution_time': np.concatenate([buy_time.to_numpy(), sell_time.to_numpy()]),
+        'trade_date': np.tile(calendar['day'][day], 2),
+        'expiry_date': np.tile(calendar['date'][index, day], 2)
+    }).sort_values('order_execution_time', kind='mergesort', ignore_index=True)
+
+    fill_number = np.arange(2 * trip_start, 2 * trip_end)
+    fills['isin'] = ''
+    fills['exchange'] = 'NSE'
+    fills['segment'] = 'FO'
+    fills['series'] = ''
+    fills['auction'] = 'false'
+    fills['trade_id'] = 700000000 + fill_number
+    fills['order_id'] = 1900000000000000 + fill_number
+    return fills[TRADEBOOK_COLUMNS]
+
+
+def iter_tradebook(rows, seed=0, trips_per_block=250_000):
+    """
+    Yield the tradebook in time-ordered blocks of whole trading days
+    """
+    rng = np.random.default_rng(seed)
+    n_trips = max(rows // 2, 1)
+    trips_per_day = max(TRIPS_PER_DAY, -(-n_trips // MAX_TRADE_DAYS))
+    n_days = -(-n_trips // trips_per_day)
+    days = pd.bdate_range(FIRST_TRADE_DAY, periods=n_days)
+    spots = _spot_paths(rng, n_days)
+    calendar = _expiry_calendar(days)
+    calendar['day'] = days.strftime('%Y-%m-%d').to_numpy(dtype=object)
+
+    block = max(trips_per_block // trips_per_day, 1) * trips_per_day
+    for trip_start in range(0, n_trips, block):
+        yield _trip_block(rng, trip_start, min(trip_start + block, n_trips), trips_per_day, days, spots, calendar)
+
+
+def generate_tradebook(rows, seed=0):
+    """
+    A synthetic tradebook of about `rows` fills (two per round trip) as one frame
+    """
+    return pd.concat(iter_tradebook(rows, seed), ignore_index=True)
+
+
+def write_tradebook(path, rows, seed=0):
+    """
+    Stream a synthetic tradebook of about `rows` fills to a CSV file
+    """
+    for number, block in enumerate(iter_tradebook(rows, seed)):
+        block.to_csv(path, mode='w' if number == 0 else 'a', header=number == 0, index=False,
+                     float_format='%.6f', date_format='%Y-%m-%dT%H:%M:%S')
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic tradebook in the Sample.csv schema.")
+    parser.add_argument('output', help="CSV file to write")
+    parser.add_argument('--rows', type=int, default=100_000, help="number of fills (default: 100000)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args(argv)
+    write_tradebook(args.output, args.rows, args.seed)
+
+
+if __name__ == '__main__':
+    main()